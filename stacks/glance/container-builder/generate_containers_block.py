@@ -2,28 +2,273 @@
 import docker
 import yaml
 import os
+import sys
 import json
+import time
+import codecs
+import hashlib
+import tempfile
 import requests
-from bs4 import BeautifulSoup
+from concurrent.futures import ThreadPoolExecutor
+from html.parser import HTMLParser
+from urllib.parse import urljoin
+from io import BytesIO
+from requests.adapters import HTTPAdapter
+from PIL import Image, ImageOps
 
-client = docker.from_env()
-containers = client.containers.list()
-output = {}
-
-print(f"[•] Détection de {len(containers)} conteneur(s)...\n")
+try:
+    import cairosvg
+except ImportError:
+    cairosvg = None
 
+output_path = "/output/containers.yml"
 override_path = "/app/config/icon_overrides.json"
 overrides = {}
+icon_cache_path = "/app/config/icon_cache.json"
+icon_cache = {}  # URL du service -> favicon résolu (ou None), validateurs HTTP et échéance
+icon_mirror_path = "/app/config/icon_mirror.json"
+icon_mirror = {}  # URL de l'icône -> copie locale, validateurs HTTP et échéance
+
+# Durée de validité (en secondes) d'un favicon trouvé, et d'un favicon introuvable ou injoignable
+ICON_TTL = int(os.environ.get("GLANCE_ICON_TTL", 7 * 86400))
+ICON_NEGATIVE_TTL = int(os.environ.get("GLANCE_ICON_NEGATIVE_TTL", 3600))
+
+# Conteneurs analysés en parallèle, et sondes de favicon lancées en parallèle pour chacun
+DISCOVERY_WORKERS = int(os.environ.get("GLANCE_DISCOVERY_WORKERS", 8))
+PROBES_PER_CONTAINER = 4
+SELFHST_ICON_URL = "https://raw.githubusercontent.com/selfhst/icons/refs/heads/main/png/{}.png"
+# Lecture des pages HTML : taille des morceaux lus, et volume maximal lu à la recherche de </head>
+HTML_CHUNK_SIZE = 16 * 1024
+HTML_BYTE_LIMIT = 256 * 1024
+
+# Copie locale des icônes, servie par Glance sous /assets : dossier, URL publique, taille
+# (carré en pixels) et format (png ou webp) des icônes normalisées, taille maximale téléchargée
+ICON_DIR = os.environ.get("GLANCE_ICON_DIR", "/assets/icons")
+ICON_URL_PREFIX = "/assets/icons/"
+ICON_SIZE = int(os.environ.get("GLANCE_ICON_SIZE", 64))
+ICON_FORMAT = os.environ.get("GLANCE_ICON_FORMAT", "png").lower()
+ICON_BYTE_LIMIT = 2 * 1024 * 1024
+
+# Session HTTP partagée : les connexions keep-alive sont réutilisées d'une sonde à l'autre,
+# notamment vers les services derrière le même Traefik et vers raw.githubusercontent.com
+session = requests.Session()
+adapter = HTTPAdapter(pool_connections=DISCOVERY_WORKERS, pool_maxsize=DISCOVERY_WORKERS * PROBES_PER_CONTAINER)
+session.mount("http://", adapter)
+session.mount("https://", adapter)
+discovery_executor = ThreadPoolExecutor(max_workers=DISCOVERY_WORKERS, thread_name_prefix="discovery")
+probe_executor = ThreadPoolExecutor(max_workers=DISCOVERY_WORKERS * PROBES_PER_CONTAINER, thread_name_prefix="probe")
 
-# Charger les overrides si présents
-if os.path.exists(override_path):
-    with open(override_path, "r", encoding="utf-8") as f:
-        overrides = json.load(f)
+# Mode démon : événements Docker qui déclenchent une mise à jour des entrées concernées
+WATCHED_EVENTS = ["start", "stop", "die", "destroy", "rename"]
+# Resynchronisation complète périodique (événements manqués, favicons devenus disponibles)
+RESYNC_INTERVAL = int(os.environ.get("GLANCE_RESYNC_INTERVAL", 3600))
+# Délai avant reconnexion au socket Docker après une coupure du flux d'événements
+RECONNECT_DELAY = 5
+
+def load_overrides():
+    """Charge les overrides d'icônes si présents"""
+    if os.path.exists(override_path):
+        with open(override_path, "r", encoding="utf-8") as f:
+            overrides.update(json.load(f))
+
+def load_icon_cache():
+    """Charge le cache des favicons résolus et l'index des icônes copiées localement si présents"""
+    for path, cache in ((icon_cache_path, icon_cache), (icon_mirror_path, icon_mirror)):
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                cache.update(json.load(f))
+        except FileNotFoundError:
+            pass
+        except ValueError:
+            print(f"[!] Cache des favicons illisible, ignoré : {path}")
+
+def write_if_changed(path, content):
+    """Écrit un fichier de façon atomique, seulement si son contenu change
+
+    Le contenu est écrit dans un fichier temporaire du même dossier puis renommé : Glance ne lit
+    jamais un fichier à moitié écrit et ne recharge sa configuration que sur un vrai changement.
+    Retourne True si le fichier a été écrit.
+    """
+    binary = isinstance(content, bytes)
+    try:
+        with open(path, "rb" if binary else "r", encoding=None if binary else "utf-8") as f:
+            if f.read() == content:
+                return False
+    except FileNotFoundError:
+        pass
+
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-", suffix=os.path.basename(path))
+    try:
+        with os.fdopen(fd, "wb" if binary else "w", encoding=None if binary else "utf-8") as f:
+            f.write(content)
+        # Conserver les permissions du fichier remplacé (mkstemp crée en 0600)
+        try:
+            os.chmod(temp_path, os.stat(path).st_mode & 0o777)
+        except FileNotFoundError:
+            os.chmod(temp_path, 0o644)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+    return True
 
 def extract_image_name(image):
     name = image.split("/")[-1]
     return name.split(":")[0] if ":" in name else name
 
+def response_validators(response):
+    """Validateurs HTTP d'une réponse, rejoués lors de la revalidation"""
+    if response is None:
+        return {"etag": None, "last_modified": None}
+    return {"etag": response.headers.get("ETag"), "last_modified": response.headers.get("Last-Modified")}
+
+class FaviconScanner(HTMLParser):
+    """Analyse incrémentale de l'en-tête d'une page HTML
+
+    Retient le premier <link> dont l'attribut rel contient "icon" et la balise <base> éventuelle ;
+    `done` passe à True dès que le favicon est trouvé ou que l'en-tête est terminé.
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.href = None
+        self.base = None
+        self.done = False
+
+    def handle_starttag(self, tag, attrs):
+        if self.done:
+            return
+        attrs = dict(attrs)
+        if tag == "link" and "icon" in (attrs.get("rel") or "").lower() and attrs.get("href"):
+            self.href = attrs["href"].strip()
+            self.done = True
+        elif tag == "base" and attrs.get("href") and self.base is None:
+            self.base = attrs["href"].strip()
+        elif tag == "body":
+            self.done = True
+
+    def handle_endtag(self, tag):
+        if tag == "head":
+            self.done = True
+
+def response_charset(response):
+    """Encodage annoncé par l'en-tête Content-Type, UTF-8 par défaut"""
+    for param in response.headers.get("Content-Type", "").split(";")[1:]:
+        name, _, value = param.partition("=")
+        if name.strip().lower() == "charset":
+            try:
+                return codecs.lookup(value.strip().strip('"')).name
+            except LookupError:
+                break
+    return "utf-8"
+
+def html_favicon(response):
+    """Retourne l'URL absolue du premier favicon déclaré par une page HTML, ou None
+
+    La page est lue en flux jusqu'à la fin de <head> (ou HTML_BYTE_LIMIT octets) : le corps des
+    applications monopage n'est jamais téléchargé. Les href relatifs sont résolus par rapport à
+    <base> et à l'URL finale de la page, après redirections.
+    """
+    content_type = response.headers.get("Content-Type", "text/html").split(";")[0].strip().lower()
+    if content_type not in ("text/html", "application/xhtml+xml"):
+        return None
+
+    scanner = FaviconScanner()
+    decoder = codecs.getincrementaldecoder(response_charset(response))(errors="replace")
+    read = 0
+    for chunk in response.iter_content(chunk_size=HTML_CHUNK_SIZE):
+        scanner.feed(decoder.decode(chunk))
+        read += len(chunk)
+        if scanner.done or read >= HTML_BYTE_LIMIT:
+            break
+    if not scanner.href:
+        return None
+    base = urljoin(response.url, scanner.base) if scanner.base else response.url
+    return urljoin(base, scanner.href)
+
+def probe_html(url):
+    """Sonde la page d'accueil d'un service à la recherche d'un favicon déclaré"""
+    try:
+        with session.get(url, timeout=5, stream=True) as r:
+            r.raise_for_status()
+            icon_url = html_favicon(r)
+    except Exception:
+        print(f"[✗] Impossible de charger HTML depuis {url}")
+        return None
+    if not icon_url:
+        print("[✗] Aucun favicon trouvé dans HTML")
+        return None
+    print(f"[✓] Favicon trouvé via HTML : {icon_url}")
+    return icon_url, url, r
+
+def probe_icon(icon_url, label):
+    """Vérifie qu'une icône existe, sans télécharger son contenu"""
+    try:
+        with session.get(icon_url, timeout=5, stream=True) as r:
+            if r.ok:
+                print(f"[✓] Favicon trouvé via {label} : {icon_url}")
+                return icon_url, icon_url, r
+    except Exception:
+        print(f"[✗] Icône injoignable via {label} : {icon_url}")
+    return None
+
+def discover_favicon(url, project_name, image_name):
+    """Cherche le favicon d'un service sur le réseau
+
+    Les sondes (page HTML, /favicon.ico, icônes selfhst par projet puis par image) partent en
+    même temps ; la première qui réussit dans cet ordre de priorité l'emporte, dès que les sondes
+    prioritaires ont échoué. Retourne (favicon ou None, URL dont la réponse l'a fourni, réponse) :
+    l'URL et les validateurs de la réponse permettent de le revalider plus tard.
+    """
+    probes = [
+        (probe_html, url),
+        (probe_icon, f"{url.rstrip('/')}/favicon.ico", "/favicon.ico"),
+        (probe_icon, SELFHST_ICON_URL.format(project_name), "GitHub (project_name)"),
+    ]
+    if image_name != project_name:
+        probes.append((probe_icon, SELFHST_ICON_URL.format(image_name), "GitHub (image)"))
+
+    futures = [probe_executor.submit(*probe) for probe in probes]
+    try:
+        for future in futures:
+            result = future.result()
+            if result:
+                return result
+    finally:
+        for future in futures:
+            future.cancel()
+
+    print("[✗] Aucun favicon disponible\n")
+    return None, None, None
+
+def revalidate_favicon(entry):
+    """Vérifie qu'un favicon en cache est toujours valable
+
+    La requête conditionnelle (If-None-Match / If-Modified-Since) porte sur la page HTML qui le
+    déclarait, ou sur l'icône elle-même : une réponse 304 suffit à confirmer l'entrée. Retourne
+    True si le favicon est confirmé, False s'il faut le rechercher, None si la source est injoignable.
+    """
+    headers = {}
+    if entry.get("etag"):
+        headers["If-None-Match"] = entry["etag"]
+    if entry.get("last_modified"):
+        headers["If-Modified-Since"] = entry["last_modified"]
+    try:
+        with session.get(entry["source"], headers=headers, timeout=5, stream=True) as r:
+            if r.status_code == 304:
+                return True
+            if not r.ok:
+                return False
+            # Page HTML modifiée : le favicon déclaré peut être resté le même
+            if entry["source"] != entry["icon"] and html_favicon(r) != entry["icon"]:
+                return False
+    except requests.exceptions.RequestException:
+        return None
+    entry.update(response_validators(r))
+    return True
+
 def find_favicon(url, project_name, image_name):
     print(f"[→] Recherche favicon pour {url}")
 
@@ -32,54 +277,127 @@ def find_favicon(url, project_name, image_name):
         print(f"[✓] Favicon forcé depuis override : {overrides[project_name]}")
         return overrides[project_name]
 
-    icon_url = None
-    try:
-        r = requests.get(url, timeout=5)
-        r.raise_for_status()
-        soup = BeautifulSoup(r.text, 'html.parser')
-        icons = soup.find_all("link", rel=lambda x: x and 'icon' in x.lower())
-        if icons:
-            href = icons[0].get("href")
-            if href:
-                icon_url = href if href.startswith("http") else url.rstrip("/") + "/" + href.lstrip("/")
-                print(f"[✓] Favicon trouvé via HTML : {icon_url}")
-                return icon_url
-        else:
-            print("[✗] Aucun favicon trouvé dans HTML")
-    except Exception:
-        print(f"[✗] Impossible de charger HTML depuis {url}")
+    now = int(time.time())
+    entry = icon_cache.get(url)
+    if entry and now < entry["expires"]:
+        print(f"[✓] Favicon depuis le cache : {entry['icon'] or 'aucun'}")
+        return entry["icon"]
 
-    test_favicon = f"{url.rstrip('/')}/favicon.ico"
-    try:
-        r = requests.get(test_favicon, timeout=5)
-        if r.ok:
-            print(f"[✓] Favicon trouvé via /favicon.ico : {test_favicon}")
-            return test_favicon
-    except:
-        pass
+    if entry and entry["icon"]:
+        valid = revalidate_favicon(entry)
+        if valid is not False:
+            # Source injoignable : l'icône connue reste utilisée et sera revérifiée plus tôt
+            entry["expires"] = now + (ICON_TTL if valid else ICON_NEGATIVE_TTL)
+            print(f"[✓] Favicon {'revalidé' if valid else 'conservé (source injoignable)'} : {entry['icon']}")
+            return entry["icon"]
 
-    github_icon = f"https://raw.githubusercontent.com/selfhst/icons/refs/heads/main/png/{project_name}.png"
-    try:
-        r = requests.get(github_icon, timeout=5)
-        if r.ok:
-            print(f"[✓] Favicon fallback via GitHub (project_name) : {github_icon}")
-            return github_icon
-    except:
-        print(f"[✗] Pas d’icône GitHub pour {project_name}")
-
-    github_icon = f"https://raw.githubusercontent.com/selfhst/icons/refs/heads/main/png/{image_name}.png"
+    icon, source, response = discover_favicon(url, project_name, image_name)
+    icon_cache[url] = {
+        "icon": icon,
+        "source": source,
+        "expires": now + (ICON_TTL if icon else ICON_NEGATIVE_TTL),
+        **response_validators(response)
+    }
+    return icon
+
+def normalize_icon(data, content_type):
+    """Convertit une icône (ICO, PNG, JPEG, GIF, WebP, SVG) en image carrée de ICON_SIZE pixels
+
+    L'image est mise à l'échelle sans déformation puis centrée sur un fond transparent. Un SVG
+    distant n'est jamais servi tel quel depuis l'origine de Glance (scripts, ressources externes) :
+    il est rasterisé par cairosvg (mode par défaut : ni entités XML, ni fichiers ou URL externes,
+    seulement les URL data:). Retourne (contenu, extension), ou None pour un SVG sans cairosvg.
+    """
+    head = data.lstrip()[:5].lower()
+    if content_type == "image/svg+xml" or head.startswith(b"<svg") or head == b"<?xml":
+        if cairosvg is None:
+            return None
+        data = cairosvg.svg2png(bytestring=data, output_width=ICON_SIZE, output_height=ICON_SIZE)
+
+    # Les ICO sont ouverts dans leur plus grande résolution disponible
+    with Image.open(BytesIO(data)) as image:
+        image = ImageOps.contain(image.convert("RGBA"), (ICON_SIZE, ICON_SIZE), Image.LANCZOS)
+    canvas = Image.new("RGBA", (ICON_SIZE, ICON_SIZE))
+    canvas.paste(image, ((ICON_SIZE - image.width) // 2, (ICON_SIZE - image.height) // 2))
+    output = BytesIO()
+    canvas.save(output, format=ICON_FORMAT, optimize=True)
+    return output.getvalue(), ICON_FORMAT
+
+def mirror_icon(icon_url):
+    """Copie une icône distante dans ICON_DIR et retourne son URL locale
+
+    Le nom du fichier est dérivé du hash de l'icône normalisée : une icône inchangée garde la même
+    URL, donc le même cache navigateur. L'icône n'est retéléchargée qu'après ICON_TTL, par une
+    requête conditionnelle. En cas d'échec, l'URL distante est conservée.
+    """
+    if not icon_url or not icon_url.startswith(("http://", "https://")):
+        return icon_url
+
+    now = int(time.time())
+    entry = icon_mirror.get(icon_url)
+    # Copie absente, ou SVG copié tel quel par une version précédente : à refaire
+    if entry and (entry["path"].endswith(".svg")
+                  or not os.path.exists(os.path.join(ICON_DIR, os.path.basename(entry["path"])))):
+        icon_mirror.pop(icon_url, None)
+        entry = None
+    if entry and now < entry["expires"]:
+        return entry["path"]
+
+    headers = {}
+    if entry and entry.get("etag"):
+        headers["If-None-Match"] = entry["etag"]
+    if entry and entry.get("last_modified"):
+        headers["If-Modified-Since"] = entry["last_modified"]
     try:
-        r = requests.get(github_icon, timeout=5)
-        if r.ok:
-            print(f"[✓] Favicon fallback via GitHub (image) : {github_icon}")
-            return github_icon
-    except:
-        print(f"[✗] Pas d’icône GitHub pour {image_name}")
+        with session.get(icon_url, headers=headers, timeout=5, stream=True) as r:
+            if r.status_code == 304:
+                entry["expires"] = now + ICON_TTL
+                return entry["path"]
+            r.raise_for_status()
+            data = b""
+            for chunk in r.iter_content(chunk_size=HTML_CHUNK_SIZE):
+                data += chunk
+                if len(data) > ICON_BYTE_LIMIT:
+                    raise ValueError("icône trop volumineuse")
+        content_type = r.headers.get("Content-Type", "").split(";")[0].strip().lower()
+        normalized = normalize_icon(data, content_type)
+    except Exception as e:
+        if entry:
+            # Copie locale conservée, nouvel essai plus tôt
+            entry["expires"] = now + ICON_NEGATIVE_TTL
+            return entry["path"]
+        print(f"[✗] Copie locale impossible pour {icon_url} : {e}")
+        return icon_url
 
-    print("[✗] Aucun favicon disponible\n")
-    return None
+    if normalized is None:
+        # SVG sans cairosvg : l'icône reste servie par son site d'origine
+        icon_mirror.pop(icon_url, None)
+        return icon_url
+    content, extension = normalized
+    filename = f"{hashlib.sha256(content).hexdigest()[:16]}.{extension}"
+    os.makedirs(ICON_DIR, exist_ok=True)
+    write_if_changed(os.path.join(ICON_DIR, filename), content)
+    icon_mirror[icon_url] = {
+        "path": ICON_URL_PREFIX + filename,
+        "expires": now + ICON_TTL,
+        **response_validators(r)
+    }
+    print(f"[✓] Icône copiée localement : {icon_url} → {ICON_URL_PREFIX}{filename}")
+    return icon_mirror[icon_url]["path"]
+
+def prune_icons():
+    """Supprime de ICON_DIR les icônes qui ne sont plus référencées par aucune copie locale"""
+    referenced = {os.path.basename(entry["path"]) for entry in icon_mirror.values()}
+    try:
+        filenames = os.listdir(ICON_DIR)
+    except FileNotFoundError:
+        return
+    for filename in filenames:
+        if filename not in referenced and not filename.startswith("."):
+            os.remove(os.path.join(ICON_DIR, filename))
 
-for container in containers:
+def container_entry(container):
+    """Construit l'entrée Glance d'un conteneur, ou None s'il n'est pas exposé via Traefik"""
     labels = container.labels
     name = container.name
     image_name = extract_image_name(container.image.tags[0]) if container.image.tags else container.image.short_id
@@ -93,32 +411,142 @@ for container in containers:
             domain = value.split("Host(`")[1].split("`)")[0]
             break
 
-    if domain:
-        url = f"https://{domain}"
-        icon = find_favicon(url, project_name, image_name)
+    if not domain:
+        print("[!] Aucune règle Traefik -prod trouvée pour ce conteneur.\n")
+        return None
 
-        output[name] = {
-            "name": project_name.capitalize(),
-            "url": url,
-            "icon": icon or "mdi:web",
-            "hide": False
-        }
+    url = f"https://{domain}"
+    icon = mirror_icon(find_favicon(url, project_name, image_name))
 
-        if project_name not in overrides:
-            overrides[project_name] = ""
+    if project_name not in overrides:
+        overrides[project_name] = ""
 
-        print(f"[✓] Conteneur ajouté : {project_name} → {url}\n")
-    else:
-        print("[!] Aucune règle Traefik -prod trouvée pour ce conteneur.\n")
+    print(f"[✓] Conteneur ajouté : {project_name} → {url}\n")
+    return {
+        "name": project_name.capitalize(),
+        "url": url,
+        "icon": icon or "mdi:web",
+        "hide": False
+    }
+
+class ContainersBuilder:
+    """Tient à jour containers.yml à partir des conteneurs en cours d'exécution
+
+    Les entrées sont indexées par identifiant de conteneur : un événement Docker ne recalcule que
+    l'entrée du conteneur concerné, et les fichiers ne sont réécrits que si leur contenu change.
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self.entries = {}  # identifiant du conteneur -> (nom, entrée Glance ou None)
 
-# Générer fichiers
-os.makedirs("/output", exist_ok=True)
+    @staticmethod
+    def try_container_entry(container):
+        """container_entry, ou None si le conteneur a disparu pendant son analyse"""
+        try:
+            return container_entry(container)
+        except docker.errors.NotFound:
+            print(f"[!] Conteneur disparu pendant l'analyse : {container.name}\n")
+            return None
 
-with open("/output/containers.yml", "w", encoding="utf-8") as f:
-    yaml.dump({"containers": output}, f, sort_keys=False)
+    def resync(self):
+        """Recalcule toutes les entrées et écrit le fichier ; une erreur Docker est journalisée"""
+        try:
+            self.refresh_all()
+            self.write()
+        except (docker.errors.DockerException, requests.exceptions.RequestException) as e:
+            print(f"[✗] Resynchronisation des conteneurs impossible : {e}")
 
-with open(override_path, "w", encoding="utf-8") as f:
-    json.dump(overrides, f, indent=2, ensure_ascii=False)
+    def refresh_all(self):
+        """Recalcule toutes les entrées à partir de la liste des conteneurs"""
+        containers = self.client.containers.list()
+        print(f"[•] Détection de {len(containers)} conteneur(s)...\n")
+        # Analyse en parallèle : la durée totale est celle du service le plus lent
+        entries = discovery_executor.map(self.try_container_entry, containers)
+        self.entries = {container.id: (container.name, entry) for container, entry in zip(containers, entries)}
+
+    def refresh_container(self, container_id):
+        """Recalcule l'entrée d'un conteneur, ou la retire s'il ne tourne plus"""
+        try:
+            container = self.client.containers.get(container_id)
+        except docker.errors.NotFound:
+            container = None
+        if container is None or container.status != "running":
+            self.entries.pop(container_id, None)
+            return
+        self.entries[container_id] = (container.name, self.try_container_entry(container))
+
+    def handle_event(self, event):
+        """Applique un événement Docker ; retourne True s'il concerne un conteneur"""
+        if event.get("Type") != "container" or event.get("Action") not in WATCHED_EVENTS:
+            return False
+        container_id = event["Actor"]["ID"]
+        name = event["Actor"].get("Attributes", {}).get("name", container_id[:12])
+        print(f"[•] Événement {event['Action']} : {name}")
+        if event["Action"] in ("stop", "die", "destroy"):
+            self.entries.pop(container_id, None)
+        else:
+            self.refresh_container(container_id)
+        return True
+
+    def render(self):
+        """Contenu de containers.yml, trié par nom de conteneur pour rester stable d'un calcul à l'autre"""
+        output = {name: entry for name, entry in sorted(self.entries.values(), key=lambda item: item[0]) if entry}
+        return yaml.dump({"containers": output}, sort_keys=False)
+
+    def write(self):
+        """Génère containers.yml, les overrides et les caches d'icônes ; seuls les fichiers modifiés sont réécrits"""
+        if write_if_changed(output_path, self.render()):
+            print(f"✅ Fichier containers.yml généré : {output_path}")
+        if write_if_changed(override_path, json.dumps(overrides, indent=2, ensure_ascii=False)):
+            print(f"✅ Fichier overrides mis à jour : {override_path}")
+        write_if_changed(icon_cache_path, json.dumps(icon_cache, indent=2, sort_keys=True))
+        write_if_changed(icon_mirror_path, json.dumps(icon_mirror, indent=2, sort_keys=True))
+        prune_icons()
+
+    def run(self, events=None):
+        """Boucle du mode démon
+
+        `events` est un itérable d'événements Docker décodés (dict) ; par défaut le flux du socket
+        Docker, borné à RESYNC_INTERVAL secondes. À la fin de chaque flux, toutes les entrées sont
+        recalculées avant de reprendre l'écoute depuis l'instant où le flux précédent a été ouvert.
+        Une erreur Docker pendant une synchronisation, y compris la première, est journalisée sans
+        arrêter le démon.
+        """
+        self.resync()
+        since = int(time.time())
+        while True:
+            until = since + RESYNC_INTERVAL
+            # L'abonnement lui-même peut échouer (socket Docker indisponible) : il est réessayé
+            # comme une coupure du flux, depuis le même instant
+            try:
+                if events is not None:
+                    stream = events
+                else:
+                    stream = self.client.events(
+                        decode=True, since=since, until=until,
+                        filters={"type": "container", "event": WATCHED_EVENTS}
+                    )
+                for event in stream:
+                    if self.handle_event(event):
+                        self.write()
+            except (docker.errors.DockerException, requests.exceptions.RequestException) as e:
+                print(f"[✗] Flux d'événements Docker interrompu : {e}")
+                time.sleep(RECONNECT_DELAY)
+            if events is not None:
+                return
+            since = min(int(time.time()), until)
+            self.resync()
+
+def main():
+    load_overrides()
+    load_icon_cache()
+    builder = ContainersBuilder(docker.from_env())
+    if "--daemon" in sys.argv[1:]:
+        builder.run()
+    else:
+        builder.refresh_all()
+        builder.write()
 
-print("✅ Fichier containers.yml généré : /output/containers.yml")
-print(f"✅ Fichier overrides mis à jour : {override_path}")
+if __name__ == "__main__":
+    main()
@@ -1,37 +1,254 @@
 #!/usr/bin/env python3
+import os
 import re
+import json
+import gzip
+import hashlib
+import tempfile
 from datetime import datetime
-from xml.sax.saxutils import escape
+from email.utils import formatdate
+from xml.sax.saxutils import escape, quoteattr
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
 
 rss_path = "/rss/index.xml"
+json_feed_path = "/rss/feed.json"
+archive_dir = "/rss/archive"
 md_path = "/updates/updates.md"
+# État de la dernière génération : empreinte des sources et de chaque page d'archive
+# (fichier caché, non servi par nginx)
+state_path = "/rss/.state.json"
+site_link = "http://rss"
+feed_link = f"{site_link}/index.xml"
+
+# Page HTML où le changelog est affiché (home_page_url du JSON Feed)
+HOME_PAGE_URL = os.environ.get("RSS_HOME_PAGE_URL", "https://tellserv.fr")
+
+# Entrées les plus récentes publiées dans le flux principal ; les plus anciennes sont réparties
+# dans des pages d'archive (RFC 5005) numérotées à partir de la plus ancienne, qui ne changent
+# donc plus une fois pleines
+MAX_ITEMS = int(os.environ.get("RSS_MAX_ITEMS", 20))
+ARCHIVE_PAGE_SIZE = int(os.environ.get("RSS_ARCHIVE_PAGE_SIZE", 50))
+
+ENTRY_HEADER = re.compile(r"## (\d{4}-\d{2}-\d{2}) - (.+)")
+NAMESPACES = 'xmlns:atom="http://www.w3.org/2005/Atom" xmlns:fh="http://purl.org/syndication/history/1.0"'
+
+def write_atomic(path, data):
+    """Écrit un fichier via un fichier temporaire renommé : nginx ne sert jamais un fichier partiel"""
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.chmod(temp_path, 0o644)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+
+def output_paths(path):
+    """Fichier publié et ses versions précompressées"""
+    paths = [path, f"{path}.gz"]
+    if brotli is not None:
+        paths.append(f"{path}.br")
+    return paths
+
+def outputs_exist(paths):
+    return all(os.path.exists(output) for path in paths for output in output_paths(path))
+
+def publish(path, data):
+    """Publie un fichier et ses versions précompressées, seulement si son contenu change
+
+    Les versions .gz (gzip_static) et .br (si le module brotli est présent) sont écrites avant le
+    fichier lui-même ; elles sont recréées si l'une d'elles manque. Retourne True si le fichier a
+    été écrit.
+    """
+    try:
+        with open(path, "rb") as f:
+            if f.read() == data and outputs_exist([path]):
+                return False
+    except FileNotFoundError:
+        pass
+
+    write_atomic(f"{path}.gz", gzip.compress(data, compresslevel=9, mtime=0))
+    if brotli is not None:
+        write_atomic(f"{path}.br", brotli.compress(data, quality=11))
+    elif os.path.exists(f"{path}.br"):
+        os.remove(f"{path}.br")
+    write_atomic(path, data)
+    return True
+
+def load_state():
+    """État de la dernière génération ; vide si absent ou illisible (tout est alors régénéré)"""
+    try:
+        with open(state_path, "r", encoding="utf-8") as f:
+            state = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+    return state if isinstance(state, dict) else {}
+
+def source_hash(*paths):
+    """Empreinte des fichiers sources (ce script, updates.md) : toute modification régénère les flux"""
+    digest = hashlib.sha256()
+    for source in paths:
+        with open(source, "rb") as f:
+            for chunk in iter(lambda: f.read(64 * 1024), b""):
+                digest.update(chunk)
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+def iter_entries(lines):
+    """Génère les entrées (date, titre, description) du changelog, ligne par ligne
+
+    Une entrée commence par une ligne "## AAAA-MM-JJ - Titre" ; les lignes suivantes, jusqu'à la
+    prochaine entrée, forment sa description.
+    """
+    header = None
+    description = []
+    for line in lines:
+        match = ENTRY_HEADER.match(line)
+        if match:
+            if header:
+                yield header[0], header[1].strip(), "\n".join(description).strip()
+            header = match.groups()
+            description = []
+        elif header:
+            description.append(line.rstrip("\n"))
+    if header:
+        yield header[0], header[1].strip(), "\n".join(description).strip()
 
-with open(md_path, "r", encoding="utf-8") as f:
-    content = f.read()
+def entry_guid(date_str, title):
+    """Identifiant stable : date et titre, indépendant de la position de l'entrée dans le fichier"""
+    return f"tellserv-updates-{date_str}-{hashlib.sha1(title.encode('utf-8')).hexdigest()[:12]}"
 
-entries = re.findall(r"## (\d{4}-\d{2}-\d{2}) - (.+?)\n(.+?)(?=\n## |\Z)", content, re.DOTALL)
+def entry_link(title):
+    return f"{feed_link}#{title.replace(' ', '-').lower()}"
 
-rss_items = ""
-for date_str, title, description in entries:
+def archive_link(page):
+    return f"{site_link}/archive/{page}.xml"
+
+def archive_path(page):
+    return os.path.join(archive_dir, f"{page}.xml")
+
+def page_key(script_digest, number, has_next, entries):
+    """Empreinte d'une page d'archive : son contenu ne dépend que du script, de sa position et de ses entrées"""
+    digest = hashlib.sha256(script_digest.encode("utf-8"))
+    digest.update(json.dumps([number, has_next, entries], ensure_ascii=False).encode("utf-8"))
+    return digest.hexdigest()
+
+def render_item(entry):
+    date_str, title, description = entry
     pubdate = datetime.strptime(date_str, "%Y-%m-%d").strftime("%a, %d %b %Y 12:00:00 GMT")
-    rss_items += f"""  <item>
-    <title>{escape(title.strip())}</title>
-    <link>http://rss/index.xml#{escape(title.strip().replace(" ", "-").lower())}</link>
+    return f"""  <item>
+    <title>{escape(title)}</title>
+    <link>{escape(entry_link(title))}</link>
+    <guid isPermaLink="false">{entry_guid(date_str, title)}</guid>
     <pubDate>{pubdate}</pubDate>
-    <description>{escape(description.strip())}</description>
-  </item>\n"""
+    <description>{escape(description)}</description>
+  </item>
+"""
 
-rss = f"""<?xml version="1.0" encoding="UTF-8" ?>
-<rss version="2.0">
+def render_rss(entries, self_link, last_build_date, links, archive=False):
+    """Document RSS : `links` associe une relation RFC 5005 (current, prev-archive...) à une URL"""
+    head = [f'  <atom:link rel="self" href={quoteattr(self_link)} type="application/rss+xml" />\n']
+    head += [f'  <atom:link rel="{rel}" href={quoteattr(href)} type="application/rss+xml" />\n'
+             for rel, href in links.items()]
+    if archive:
+        head.append("  <fh:archive />\n")
+
+    return f"""<?xml version="1.0" encoding="UTF-8" ?>
+<rss version="2.0" {NAMESPACES}>
 <channel>
   <title>Updates serveur</title>
-  <link>http://rss/index.xml</link>
+  <link>{feed_link}</link>
   <description>Changelog des services Tellserv</description>
-{rss_items}</channel>
+  <lastBuildDate>{last_build_date}</lastBuildDate>
+{"".join(head)}{"".join(render_item(entry) for entry in entries)}</channel>
 </rss>
 """
 
-with open(rss_path, "w", encoding="utf-8") as f:
-    f.write(rss)
+def render_json_feed(entries):
+    """Flux principal au format JSON Feed 1.1"""
+    feed = {
+        "version": "https://jsonfeed.org/version/1.1",
+        "title": "Updates serveur",
+        "home_page_url": HOME_PAGE_URL,
+        "feed_url": f"{site_link}/feed.json",
+        "description": "Changelog des services Tellserv",
+        "items": [
+            {
+                "id": entry_guid(date_str, title),
+                "url": entry_link(title),
+                "title": title,
+                "content_text": description,
+                "date_published": f"{date_str}T12:00:00Z",
+            }
+            for date_str, title, description in entries
+        ],
+    }
+    return json.dumps(feed, indent=2, ensure_ascii=False) + "\n"
+
+def page_build_date(entries):
+    """Date de construction d'une page d'archive : celle de sa plus récente entrée, pour qu'elle reste stable"""
+    return datetime.strptime(entries[0][0], "%Y-%m-%d").strftime("%a, %d %b %Y 12:00:00 GMT")
+
+def main():
+    state = load_state()
+    previous_pages = state.get("pages", [])
+    digest = source_hash(__file__, md_path)
+    # Sources inchangées : rien à faire, sauf si un fichier publié a disparu
+    expected = [rss_path, json_feed_path] + [archive_path(number) for number in range(1, len(previous_pages) + 1)]
+    if state.get("sources") == digest and outputs_exist(expected):
+        return
+
+    with open(md_path, "r", encoding="utf-8") as f:
+        # Tri stable du plus récent au plus ancien : l'ordre du fichier départage les entrées d'un même jour
+        entries = sorted(iter_entries(f), key=lambda entry: entry[0], reverse=True)
+
+    current, archived = entries[:MAX_ITEMS], entries[MAX_ITEMS:]
+    # Pages d'archive ancrées sur la plus ancienne entrée : une nouvelle entrée ne touche que la dernière page
+    oldest_first = archived[::-1]
+    pages = [oldest_first[start:start + ARCHIVE_PAGE_SIZE] for start in range(0, len(oldest_first), ARCHIVE_PAGE_SIZE)]
+
+    # Date de modification de updates.md : un même contenu produit toujours le même flux
+    last_build_date = formatdate(os.stat(md_path).st_mtime, usegmt=True)
+
+    written = 0
+    if pages:
+        os.makedirs(archive_dir, exist_ok=True)
+    # Seules les pages dont l'empreinte a changé (en pratique la dernière) sont rendues et réécrites
+    script_digest = source_hash(__file__)
+    page_keys = []
+    for number, page in enumerate(pages, start=1):
+        has_next = number < len(pages)
+        key = page_key(script_digest, number, has_next, page)
+        page_keys.append(key)
+        if previous_pages[number - 1:number] == [key] and outputs_exist([archive_path(number)]):
+            continue
+        links = {"current": feed_link}
+        if number > 1:
+            links["prev-archive"] = archive_link(number - 1)
+        if has_next:
+            links["next-archive"] = archive_link(number + 1)
+        page_entries = page[::-1]
+        rss = render_rss(page_entries, archive_link(number), page_build_date(page_entries), links, archive=True)
+        written += publish(archive_path(number), rss.encode("utf-8"))
+
+    # Pages devenues inutiles (entrées supprimées du changelog)
+    if os.path.isdir(archive_dir):
+        for filename in os.listdir(archive_dir):
+            number = filename.split(".")[0]
+            if number.isdigit() and int(number) > len(pages):
+                os.remove(os.path.join(archive_dir, filename))
+
+    links = {"prev-archive": archive_link(len(pages))} if pages else {}
+    written += publish(json_feed_path, render_json_feed(current).encode("utf-8"))
+    written += publish(rss_path, render_rss(current, feed_link, last_build_date, links).encode("utf-8"))
+    write_atomic(state_path, json.dumps({"sources": digest, "pages": page_keys}).encode("utf-8"))
+
+    print(f"Flux RSS généré : {len(current)} entrées, {len(pages)} page(s) d'archive, {written} fichier(s) écrit(s).")
 
-print("Flux RSS généré.")
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,482 @@
+#!/usr/bin/env python3
+"""Benchmark reproductible du pipeline d'ingestion de kavita_script.py
+
+Génère une arborescence de téléchargement synthétique (nombreux petits CBZ/CBR/EPUB, quelques gros
+PDF, dossiers imbriqués, fichiers temporaires .parts) dans un BASE_PATH temporaire, puis enchaîne
+scan_download_directory, process_stable_folders, convert_files et rename_and_move en mesurant pour
+chaque étape le débit, les latences (p50/p90/p99), la mémoire maximale et le nombre d'appels
+read/write (/proc/self/io). Avec --strace, chaque étape est aussi tracée par `strace -c -f` pour
+compter les appels système de parcours du disque (stat, getdents, open) que /proc/self/io ignore.
+
+Exemples :
+    python3 benchmark.py --output avant.json
+    python3 benchmark.py --output apres.json --compare avant.json
+    python3 benchmark.py --fake-tools --small 2000   # coût du pipeline seul, sans conversion réelle
+    python3 benchmark.py --fake-tools --strace       # + appels stat/getdents/open par étape
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import struct
+import zlib
+import zipfile
+import logging
+import argparse
+import ctypes
+import signal
+import resource
+import tempfile
+import subprocess
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import kavita_script as kavita
+
+CATEGORIES = ['manga', 'comics', 'bd']
+# Horodatage appliqué aux fichiers générés : assez ancien pour que la politique de stabilité
+# les libère dès leur deuxième observation, comme des téléchargements terminés
+GENERATED_AGE = 3600
+
+# Outils factices (--fake-tools) : mesurent le coût du pipeline sans pdftoppm ni cbconvert réels
+FAKE_TOOLS = {
+    'pdfinfo': '''
+import re, sys
+data = open(sys.argv[-1], 'rb').read()
+match = re.search(rb'/Count (\\d+)', data)
+print(f"Pages:          {int(match.group(1)) if match else 1}")
+''',
+    'pdffonts': '''
+print("name type encoding emb sub uni object ID")
+print("---- ---- -------- --- --- --- ---------")
+''',
+    'pdfimages': '''
+print("page num type width height color comp bpc enc interp object ID x-ppi y-ppi size ratio")
+print("-------------------------------------------------------------------------------------")
+''',
+    'pdftoppm': '''
+import sys
+args = sys.argv[1:]
+first = int(args[args.index('-f') + 1]) if '-f' in args else 1
+last = int(args[args.index('-l') + 1]) if '-l' in args else first
+for page in range(first, last + 1):
+    with open(f"{args[-1]}-{page:04d}.jpg", 'wb') as f:
+        f.write(b'\\xff\\xd8' + bytes(2048) + b'\\xff\\xd9')
+''',
+    'cbconvert': '''
+import os, shutil, sys
+args = sys.argv[1:]
+outdir = args[args.index('--outdir') + 1]
+name = os.path.splitext(os.path.basename(args[-1]))[0]
+shutil.copyfile(args[-1], os.path.join(outdir, f"{name}.cbz"))
+''',
+}
+
+def png_page(rng, width, height):
+    """Image PNG en niveaux de gris : dégradé avec du bruit, pour une taille compressée réaliste"""
+    ramp = bytes(range(256)) * (width // 256 + 2)
+    rows = []
+    for y in range(height):
+        noise = rng.randbytes(width // 4)
+        start = y % 256
+        rows.append(b'\x00' + ramp[start:start + width - len(noise)] + noise)
+
+    def chunk(kind, data):
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+
+    header = struct.pack('>IIBBBBB', width, height, 8, 0, 0, 0, 0)
+    return (b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', header)
+            + chunk(b'IDAT', zlib.compress(b''.join(rows), 6)) + chunk(b'IEND', b''))
+
+def write_archive(path, rng, pages, epub=False):
+    """Écrit une archive d'images (CBZ, CBR au format zip, ou EPUB minimal)"""
+    with zipfile.ZipFile(path, 'w') as archive:
+        if epub:
+            archive.writestr('mimetype', 'application/epub+zip', compress_type=zipfile.ZIP_STORED)
+            archive.writestr('META-INF/container.xml', (
+                '<?xml version="1.0"?><container version="1.0" '
+                'xmlns="urn:oasis:names:tc:opendocument:xmlns:container"><rootfiles>'
+                '<rootfile full-path="content.opf" media-type="application/oebps-package+xml"/>'
+                '</rootfiles></container>'
+            ))
+        for page in range(1, pages + 1):
+            name = f"images/{page:03d}.png" if epub else f"{page:03d}.png"
+            archive.writestr(name, png_page(rng, 400, 600))
+
+def write_pdf(path, pages):
+    """Écrit un PDF vectoriel de `pages` pages A4, sans police ni image (rasterisé par pdftoppm)"""
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        b"<< /Type /Pages /Kids [" + b" ".join(b"%d 0 R" % (3 + 2 * i) for i in range(pages))
+        + b"] /Count %d >>" % pages,
+    ]
+    for i in range(pages):
+        content = b"0.%d g 40 40 515 762 re f 0 g 80 80 435 40 re f" % (i % 10)
+        objects.append(b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] /Contents %d 0 R >>" % (4 + 2 * i))
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(content), content))
+
+    with open(path, 'wb') as f:
+        f.write(b"%PDF-1.4\n")
+        offsets = []
+        for number, body in enumerate(objects, start=1):
+            offsets.append(f.tell())
+            f.write(b"%d 0 obj\n%s\nendobj\n" % (number, body))
+        xref = f.tell()
+        f.write(b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1))
+        for offset in offsets:
+            f.write(b"%010d 00000 n \n" % offset)
+        f.write(b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref))
+
+def generate_tree(download_dir, args):
+    """Génère l'arborescence de téléchargement et retourne (fichiers à traiter, octets)"""
+    rng = random.Random(args.seed)
+    files = 0
+    total_bytes = 0
+
+    for index in range(args.small):
+        category = CATEGORIES[index % len(CATEGORIES)]
+        series = f"Serie {index % args.series:03d}"
+        folder = os.path.join(download_dir, category, series)
+        # Une partie des séries est rangée dans des sous-dossiers imbriqués
+        if index % 5 == 0:
+            folder = os.path.join(folder, *[f"niveau {depth}" for depth in range(args.depth)])
+        os.makedirs(folder, exist_ok=True)
+
+        extension = ['.cbz', '.cbr', '.epub'][index % 3]
+        path = os.path.join(folder, f"{series} v{index // args.series + 1:02d}{extension}")
+        write_archive(path, rng, args.pages, epub=extension == '.epub')
+        files += 1
+        total_bytes += os.path.getsize(path)
+
+    for index in range(args.pdfs):
+        folder = os.path.join(download_dir, 'bd', f"Integrale {index:02d}")
+        os.makedirs(folder, exist_ok=True)
+        path = os.path.join(folder, f"Integrale {index:02d} T01.pdf")
+        write_pdf(path, args.pdf_pages)
+        files += 1
+        total_bytes += os.path.getsize(path)
+
+    # Téléchargements en cours, qui doivent être ignorés par le watcher
+    for index in range(args.parts):
+        folder = os.path.join(download_dir, 'manga', f"En cours {index:02d}")
+        os.makedirs(os.path.join(folder, '.parts'), exist_ok=True)
+        with open(os.path.join(folder, f"En cours {index:02d} v01.cbz.parts"), 'wb') as f:
+            f.write(rng.randbytes(4096))
+        with open(os.path.join(folder, '.parts', 'fragment'), 'wb') as f:
+            f.write(rng.randbytes(4096))
+
+    # Vieillir fichiers et dossiers (du plus profond au plus haut) : téléchargements terminés
+    past = time.time() - GENERATED_AGE
+    for root, dirs, names in os.walk(download_dir, topdown=False):
+        for name in names:
+            os.utime(os.path.join(root, name), (past, past))
+        os.utime(root, (past, past))
+
+    return files, total_bytes
+
+def install_fake_tools(bin_dir):
+    os.makedirs(bin_dir, exist_ok=True)
+    for name, source in FAKE_TOOLS.items():
+        path = os.path.join(bin_dir, name)
+        with open(path, 'w') as f:
+            f.write(f"#!{sys.executable}\n{source}")
+        os.chmod(path, 0o755)
+    os.environ['PATH'] = f"{bin_dir}{os.pathsep}{os.environ.get('PATH', '')}"
+
+# Regroupement des appels système comptés par strace -c
+SYSCALL_GROUPS = {
+    'stat': ('stat', 'lstat', 'fstat', 'newfstatat', 'fstatat64', 'stat64', 'lstat64', 'fstat64', 'statx'),
+    'getdents': ('getdents', 'getdents64'),
+    'open': ('open', 'openat', 'openat2'),
+}
+# prctl(PR_SET_PTRACER, PR_SET_PTRACER_ANY) : autorise strace (processus enfant) à s'attacher
+# au benchmark malgré la restriction Yama ptrace_scope = 1
+PR_SET_PTRACER = 0x59616d61
+PR_SET_PTRACER_ANY = ctypes.c_ulong(-1)
+
+class SyscallTracer:
+    """Compte les appels système d'une étape en attachant `strace -c -f` au processus courant
+
+    strace s'attache à tous les threads du benchmark (et suit les outils qu'ils lancent) ; son
+    résumé, écrit au détachement, donne le nombre d'appels par appel système.
+    """
+
+    def __init__(self, work_dir):
+        self.output = os.path.join(work_dir, 'strace.txt')
+        self.process = None
+        libc = ctypes.CDLL(None, use_errno=True)
+        libc.prctl(PR_SET_PTRACER, PR_SET_PTRACER_ANY, 0, 0, 0)
+
+    def start(self):
+        self.process = subprocess.Popen(
+            ['strace', '-c', '-f', '-o', self.output, '-p', str(os.getpid())],
+            stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True
+        )
+        # Attendre que strace soit attaché avant de lancer l'étape mesurée
+        for line in self.process.stderr:
+            if 'attached' in line:
+                break
+        else:
+            raise RuntimeError(f"strace n'a pas pu s'attacher (code {self.process.wait()})")
+
+    def stop(self):
+        """Détache strace et retourne le nombre d'appels par groupe (stat, getdents, open, total)"""
+        self.process.send_signal(signal.SIGINT)
+        self.process.wait()
+        self.process.stderr.close()
+        counts = {group: 0 for group in SYSCALL_GROUPS}
+        counts['total'] = 0
+        with open(self.output) as f:
+            for line in f:
+                fields = line.split()
+                # % time, seconds, usecs/call, calls, [errors,] syscall
+                if len(fields) < 5 or not fields[3].isdigit() or fields[-1] == 'total':
+                    continue
+                calls, name = int(fields[3]), fields[-1]
+                counts['total'] += calls
+                for group, names in SYSCALL_GROUPS.items():
+                    if name in names:
+                        counts[group] += calls
+        return counts
+
+def read_proc_io():
+    """Compteurs d'E/S du processus (/proc/self/io)
+
+    syscr/syscw ne comptent que les appels read/write : les stat et getdents du parcours du
+    disque n'y figurent pas (voir --strace).
+    """
+    counters = {}
+    try:
+        with open('/proc/self/io') as f:
+            for line in f:
+                key, value = line.split(':')
+                counters[key] = int(value)
+    except OSError:
+        pass
+    return counters
+
+def percentiles(values):
+    if not values:
+        return {}
+    ordered = sorted(values)
+
+    def pick(fraction):
+        return round(ordered[min(len(ordered) - 1, int(fraction * len(ordered)))], 6)
+
+    return {'p50': pick(0.50), 'p90': pick(0.90), 'p99': pick(0.99), 'max': round(ordered[-1], 6)}
+
+class Phase:
+    """Mesure une étape : durée, temps CPU (processus et enfants), E/S, appels read/write et,
+    si un SyscallTracer est actif, appels système par groupe"""
+
+    # SyscallTracer partagé par toutes les étapes (--strace), None sinon
+    tracer = None
+
+    def __init__(self, results, name, files=0, size=0):
+        self.results = results
+        self.name = name
+        self.files = files
+        self.size = size
+
+    def __enter__(self):
+        if Phase.tracer is not None:
+            Phase.tracer.start()
+        self.io = read_proc_io()
+        self.children = resource.getrusage(resource.RUSAGE_CHILDREN)
+        self.cpu = time.process_time()
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.started
+        cpu = time.process_time() - self.cpu
+        children = resource.getrusage(resource.RUSAGE_CHILDREN)
+        io = read_proc_io()
+        children_cpu = children.ru_utime + children.ru_stime - self.children.ru_utime - self.children.ru_stime
+
+        phase = {
+            'seconds': round(elapsed, 6),
+            'cpu_seconds': round(cpu, 6),
+            # Différence de deux sommes flottantes : peut être très légèrement négative
+            'children_cpu_seconds': max(0.0, round(children_cpu, 6)),
+            'read_calls': io.get('syscr', 0) - self.io.get('syscr', 0),
+            'write_calls': io.get('syscw', 0) - self.io.get('syscw', 0),
+            'bytes_read': io.get('rchar', 0) - self.io.get('rchar', 0),
+            'bytes_written': io.get('wchar', 0) - self.io.get('wchar', 0),
+        }
+        if self.files and elapsed > 0:
+            phase['files_per_second'] = round(self.files / elapsed, 3)
+        if self.size and elapsed > 0:
+            phase['mb_per_second'] = round(self.size / elapsed / (1024 * 1024), 3)
+        if Phase.tracer is not None:
+            phase['syscalls'] = Phase.tracer.stop()
+        self.results['phases'][self.name] = phase
+
+def run_benchmark(base_path, args):
+    results = {'config': vars(args).copy(), 'phases': {}, 'latency': {}}
+    results['config'].pop('output', None)
+    results['config'].pop('compare', None)
+
+    kavita.set_base_path(base_path)
+    kavita.CONVERT_QUEUE_LIMIT = sys.maxsize
+    kavita.job_store = kavita.JobStore(os.path.join(base_path, 'benchmark.db'))
+
+    with Phase(results, 'generate'):
+        files, total_bytes = generate_tree(kavita.DOWNLOAD_DIR, args)
+    results['config']['files'] = files
+    results['config']['bytes'] = total_bytes
+
+    # 1. Détection : premier scan complet, puis scans jusqu'à la stabilité de tous les fichiers
+    with Phase(results, 'scan_cold', files):
+        kavita.scan_download_directory()
+    with Phase(results, 'scan_until_stable', files):
+        for _ in range(10):
+            kavita.scan_download_directory()
+            if not kavita.detected_files.has_pending():
+                break
+
+    scan_times = []
+    with Phase(results, 'scan_warm'):
+        for _ in range(args.scan_repeats):
+            started = time.perf_counter()
+            kavita.scan_download_directory()
+            scan_times.append(time.perf_counter() - started)
+    results['latency']['scan_warm_seconds'] = percentiles(scan_times)
+
+    # 2. Déplacement des dossiers stables vers to_convert
+    with Phase(results, 'stage', files, total_bytes):
+        kavita.process_stable_folders()
+    kavita.job_store.sync_detected(kavita.detected_files)
+
+    # 3. Conversion : latence de chaque fichier depuis le début de l'étape, et durée propre
+    service_times = []
+    completion_times = []
+    convert_job = kavita.convert_job
+
+    def timed_convert_job(file_path):
+        started = time.perf_counter()
+        try:
+            return convert_job(file_path)
+        finally:
+            finished = time.perf_counter()
+            service_times.append(finished - started)
+            completion_times.append(finished - convert_started)
+
+    kavita.convert_job = timed_convert_job
+    try:
+        convert_started = time.perf_counter()
+        with Phase(results, 'convert', files, total_bytes):
+            kavita.convert_files()
+    finally:
+        kavita.convert_job = convert_job
+    results['latency']['conversion_seconds'] = percentiles(service_times)
+    results['latency']['completion_seconds'] = percentiles(completion_times)
+
+    # 4. Renommage et déplacement dans la bibliothèque
+    with Phase(results, 'rename_and_move', files):
+        for source_dir, dest_dir, category in kavita.CATEGORIES.values():
+            kavita.rename_and_move(source_dir, dest_dir, category)
+
+    imported = sum(len(names) for _, _, names in os.walk(os.path.join(base_path, 'scans')))
+    results['config']['imported'] = imported
+    results['peak_rss_mb'] = {
+        'self': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        'children': round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024, 1),
+    }
+    results['moves'] = kavita.move_stats.snapshot()
+    kavita.job_store.close()
+    return results
+
+def flatten(results, prefix=''):
+    """Aplatit les valeurs numériques d'un résultat : {'phases.convert.seconds': 1.2, ...}"""
+    values = {}
+    for key, value in results.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            values.update(flatten(value, f"{name}."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            values[name] = value
+    return values
+
+def compare(before, after):
+    """Affiche l'évolution de chaque mesure entre deux exécutions"""
+    old, new = flatten(before), flatten(after)
+    if before.get('config') != after.get('config'):
+        print("Attention : les deux exécutions n'ont pas la même configuration")
+
+    width = max((len(name) for name in new), default=0)
+    for name in sorted(set(old) | set(new)):
+        if name.startswith('config.'):
+            continue
+        if name not in old or name not in new:
+            print(f"{name:<{width}}  {old.get(name, '-')!s:>14} -> {new.get(name, '-')!s:>14}")
+            continue
+        change = f"{(new[name] - old[name]) / old[name] * 100:+.1f} %" if old[name] else ""
+        print(f"{name:<{width}}  {old[name]!s:>14} -> {new[name]!s:>14}  {change}")
+
+def print_report(results):
+    config = results['config']
+    print(f"{config['files']} fichiers, {config['bytes'] / (1024 * 1024):.1f} Mo, {config['imported']} importés")
+    for name, phase in results['phases'].items():
+        rate = f", {phase['files_per_second']} fichiers/s" if 'files_per_second' in phase else ""
+        print(
+            f"  {name:<18} {phase['seconds']:>9.3f}s{rate} "
+            f"(CPU {phase['cpu_seconds']:.2f}s + enfants {phase['children_cpu_seconds']:.2f}s, "
+            f"{phase['read_calls']} read, {phase['write_calls']} write)"
+        )
+        if 'syscalls' in phase:
+            print(f"  {'':<18} appels système : " + ", ".join(f"{count} {group}" for group, count in phase['syscalls'].items()))
+    for name, values in results['latency'].items():
+        print(f"  {name:<18} " + ", ".join(f"{key} {value:.4f}s" for key, value in values.items()))
+    print(f"  RSS max: {results['peak_rss_mb']['self']} Mo (processus), {results['peak_rss_mb']['children']} Mo (outils)")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--small', type=int, default=300, help="nombre de petits CBZ/CBR/EPUB")
+    parser.add_argument('--series', type=int, default=30, help="nombre de séries entre lesquelles les répartir")
+    parser.add_argument('--pages', type=int, default=6, help="pages par petit fichier")
+    parser.add_argument('--pdfs', type=int, default=2, help="nombre de gros PDF")
+    parser.add_argument('--pdf-pages', type=int, default=200, help="pages par PDF")
+    parser.add_argument('--depth', type=int, default=4, help="profondeur des dossiers imbriqués")
+    parser.add_argument('--parts', type=int, default=20, help="téléchargements .parts en cours")
+    parser.add_argument('--scan-repeats', type=int, default=50, help="scans répétés pour les percentiles")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--fake-tools', action='store_true', help="remplacer pdftoppm/cbconvert par des outils factices")
+    parser.add_argument('--base', help="BASE_PATH à utiliser (par défaut : dossier temporaire supprimé ensuite)")
+    parser.add_argument('--output', help="fichier JSON où enregistrer les résultats")
+    parser.add_argument('--compare', help="résultats JSON d'une exécution précédente à comparer")
+    parser.add_argument('--strace', action='store_true',
+                        help="compter les appels stat/getdents/open de chaque étape avec strace -c (plus lent)")
+    parser.add_argument('--verbose', action='store_true', help="afficher les journaux du pipeline")
+    args = parser.parse_args()
+    if args.strace and not shutil.which('strace'):
+        parser.error("--strace nécessite strace")
+
+    if not args.verbose:
+        logging.getLogger().setLevel(logging.WARNING)
+
+    base_path = args.base or tempfile.mkdtemp(prefix="kavita-bench-")
+    if args.base and os.path.exists(base_path) and os.listdir(base_path):
+        parser.error(f"{base_path} n'est pas vide")
+    try:
+        if args.fake_tools:
+            install_fake_tools(os.path.join(base_path, 'bin'))
+        if args.strace:
+            Phase.tracer = SyscallTracer(base_path)
+        results = run_benchmark(base_path, args)
+    finally:
+        if not args.base:
+            shutil.rmtree(base_path, ignore_errors=True)
+
+    print_report(results)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    if args.compare:
+        with open(args.compare) as f:
+            print()
+            compare(json.load(f), results)
+
+if __name__ == "__main__":
+    main()
@@ -6,8 +6,26 @@ import logging
 import time
 import zipfile
 import tempfile
-from pathlib import Path
-from datetime import datetime, timedelta
+import ctypes
+import errno
+import select
+import struct
+import re
+import sqlite3
+import queue
+import itertools
+import shlex
+import signal
+import platform
+import heapq
+import zlib
+import hashlib
+import json
+import urllib.request
+import urllib.error
+import http.server
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 import threading
 
 # Configuration du logging
@@ -21,6 +39,8 @@ BASE_PATH = "/mnt/storage/kavita"
 DOWNLOAD_DIR = f"{BASE_PATH}/download"
 TO_CONVERT_DIR = f"{BASE_PATH}/to_convert"
 CBZ_CONVERT_DIR = f"{BASE_PATH}/cbz_convert"
+# Volumes déjà présents dans la bibliothèque, mis de côté pour vérification manuelle
+DUPLICATES_DIR = f"{BASE_PATH}/duplicates"
 
 # Chemins de destination
 MANGA_DEST = f"{BASE_PATH}/scans/Mangas"
@@ -32,171 +52,1936 @@ MANGA_SRC = f"{CBZ_CONVERT_DIR}/manga"
 COMICS_SRC = f"{CBZ_CONVERT_DIR}/comics"
 BD_SRC = f"{CBZ_CONVERT_DIR}/bd"
 
+# Nombre de vérifications consécutives sans changement avant qu'un fichier soit considéré stable
+# (politique "count" ; en politique "adaptive", STABLE_COUNT * SCAN_INTERVAL secondes sans changement
+# restent la borne haute au-delà de laquelle un fichier est toujours libéré)
+STABLE_COUNT = 5
+# Politique de stabilité : "adaptive" (événements close-write, âge du mtime, écrivains ouverts,
+# vitesse de croissance) ou "count" (STABLE_COUNT vérifications sans changement)
+STABILITY_POLICY = os.environ.get("KAVITA_STABILITY_POLICY", "adaptive").lower()
+# Intervalle (en secondes) de revérification des fichiers instables en politique "adaptive"
+STABILITY_CHECK_INTERVAL = float(os.environ.get("KAVITA_STABILITY_CHECK_INTERVAL", "2"))
+# Âge minimal du mtime (en secondes) avant de libérer un fichier, selon ce qui a été observé :
+# fermeture après écriture (ou renommage dans download), fichier jamais vu grandir,
+# fichier vu grandir, fichier qui grandissait lentement (téléchargement qui peut reprendre)
+CLOSE_WRITE_QUIET = 2
+MIN_QUIET = 10
+GROWING_QUIET = 30
+SLOW_GROWTH_QUIET = 120
+# Vitesse de croissance (octets/s) en dessous de laquelle un téléchargement est considéré lent
+SLOW_GROWTH_RATE = 64 * 1024
+# Un dossier modifié depuis moins longtemps que ce délai (en secondes) est relisté au cycle suivant :
+# une création dans la même granularité d'horodatage ne changerait pas son mtime
+DIR_MTIME_GRACE = 2
+
+class FileState:
+    """État de stabilité d'un fichier suivi
+
+    `changed_at` est l'heure de la dernière modification observée, `growth_rate` la vitesse de
+    croissance mesurée entre les deux dernières observations (None si jamais vu grandir) et
+    `closed` indique qu'une fermeture après écriture a été reçue depuis cette modification.
+    """
+    __slots__ = ('size', 'mtime', 'stable_count', 'stable', 'changed_at', 'growth_rate', 'closed')
+
+    def __init__(self, size, mtime, changed_at):
+        self.size = size
+        self.mtime = mtime
+        self.stable_count = 0
+        self.stable = False
+        self.changed_at = changed_at
+        self.growth_rate = None
+        self.closed = False
+
+class FolderState:
+    """Fichiers suivis d'un dossier (nom -> FileState) et nombre de fichiers encore instables"""
+    __slots__ = ('files', 'pending')
+
+    def __init__(self):
+        self.files = {}
+        self.pending = 0
+
+class OpenWriterScanner:
+    """Recherche dans /proc les fichiers de download ouverts en écriture
+
+    Seuls les processus visibles depuis ce conteneur sont vus : un client de téléchargement
+    d'un autre conteneur n'apparaît pas, d'où les délais d'âge du mtime de AdaptivePolicy.
+    Le résultat est mis en cache `max_age` secondes pour ne parcourir /proc qu'une fois par cycle.
+    """
+
+    def __init__(self, max_age=1.0):
+        self.max_age = max_age
+        self._paths = set()
+        self._taken = None
+
+    def _scan(self):
+        paths = set()
+        prefix = DOWNLOAD_DIR.rstrip(os.sep) + os.sep
+        try:
+            pids = [pid for pid in os.listdir('/proc') if pid.isdigit()]
+        except OSError:
+            return paths
+
+        for pid in pids:
+            fd_dir = f"/proc/{pid}/fd"
+            try:
+                fds = os.listdir(fd_dir)
+            except OSError:
+                continue
+            for fd in fds:
+                try:
+                    target = os.readlink(f"{fd_dir}/{fd}")
+                    if not target.startswith(prefix):
+                        continue
+                    with open(f"/proc/{pid}/fdinfo/{fd}") as fdinfo:
+                        for line in fdinfo:
+                            if line.startswith('flags:'):
+                                if int(line.split()[1], 8) & (os.O_WRONLY | os.O_RDWR):
+                                    paths.add(target)
+                                break
+                except (OSError, ValueError, IndexError):
+                    continue
+        return paths
+
+    def is_open_for_write(self, file_path):
+        now = time.monotonic()
+        if self._taken is None or now - self._taken > self.max_age:
+            self._paths = self._scan()
+            self._taken = now
+        return file_path in self._paths
+
+class CountPolicy:
+    """Politique historique : stable après STABLE_COUNT vérifications sans changement"""
+
+    @property
+    def check_interval(self):
+        return SCAN_INTERVAL
+
+    def is_stable(self, file_path, state, now):
+        return state.stable_count >= STABLE_COUNT
+
+class AdaptivePolicy:
+    """Politique adaptative : libère en quelques secondes un fichier terminé
+
+    Un fichier est stable quand son mtime est assez ancien et qu'aucun processus visible ne
+    l'a ouvert en écriture. Le délai dépend de ce qui a été observé : court après une
+    fermeture (close-write) ou un renommage dans download, plus long pour un fichier vu grandir,
+    et encore plus long s'il grandissait lentement. Au-delà de STABLE_COUNT * SCAN_INTERVAL
+    secondes sans changement, le fichier est libéré comme avec la politique "count".
+    """
+    check_interval = STABILITY_CHECK_INTERVAL
+
+    def __init__(self, writers=None):
+        self.writers = writers if writers is not None else OpenWriterScanner()
+
+    def quiet_period(self, state):
+        if state.closed:
+            return CLOSE_WRITE_QUIET
+        if state.growth_rate is None:
+            return MIN_QUIET
+        if state.growth_rate < SLOW_GROWTH_RATE:
+            return SLOW_GROWTH_QUIET
+        return GROWING_QUIET
+
+    def is_stable(self, file_path, state, now):
+        if now - state.changed_at >= STABLE_COUNT * SCAN_INTERVAL:
+            return True
+        if now - state.mtime < self.quiet_period(state):
+            return False
+        return not self.writers.is_open_for_write(file_path)
+
+class FileIndex:
+    """Index des fichiers téléchargés, regroupés par dossier et mis à jour incrémentalement
+
+    Le compteur `pending` de chaque dossier permet de savoir en O(1) si un dossier est stable,
+    et `dir_cache` mémorise le mtime et les sous-dossiers de chaque dossier déjà listé pour
+    que le scan ne reliste que les dossiers dont le contenu a changé.
+    """
+
+    def __init__(self):
+        self.folders = {}    # dossier -> FolderState
+        self.dir_cache = {}  # dossier -> (st_mtime_ns, tuple des sous-dossiers)
+        self.changed = set()  # fichiers modifiés depuis la dernière synchronisation avec JobStore
+        self.removed = set()  # fichiers retirés depuis la dernière synchronisation avec JobStore
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def __contains__(self, file_path):
+        return self.get(file_path) is not None
+
+    def get(self, file_path):
+        """Retourne l'état d'un fichier suivi, ou None"""
+        folder_path, name = os.path.split(file_path)
+        folder = self.folders.get(folder_path)
+        return folder.files.get(name) if folder is not None else None
+
+    def observe(self, file_path, size, mtime, touched=False, closed=False):
+        """Enregistre la taille et le mtime observés d'un fichier et retourne True s'il a changé
+
+        Un fichier nouveau ou modifié repart de zéro ; un fichier inchangé voit son compteur de
+        stabilité incrémenté puis est soumis à la politique de stabilité. `touched` indique qu'un
+        événement d'écriture a été reçu : le compteur repart alors de zéro même si la taille n'a
+        pas changé. `closed` indique une fermeture après écriture ou un renommage dans download.
+        """
+        now = time.time()
+        folder_path, name = os.path.split(file_path)
+        folder = self.folders.get(folder_path)
+        if folder is None:
+            folder = self.folders[folder_path] = FolderState()
+
+        state = folder.files.get(name)
+        if state is None:
+            state = folder.files[name] = FileState(size, mtime, now)
+            state.closed = closed
+            folder.pending += 1
+            self._count += 1
+            self.changed.add(file_path)
+            self.removed.discard(file_path)
+            logging.info(f"Nouveau fichier détecté: {file_path}")
+            return True
+
+        if size != state.size or mtime != state.mtime or touched:
+            if size != state.size or state.stable:
+                logging.info(f"Fichier modifié: {file_path}")
+            if state.stable:
+                folder.pending += 1
+            if size > state.size and now > state.changed_at:
+                state.growth_rate = (size - state.size) / (now - state.changed_at)
+            state.size = size
+            state.mtime = mtime
+            state.stable_count = 0
+            state.stable = False
+            state.changed_at = now
+            state.closed = closed
+            self.changed.add(file_path)
+            return True
+
+        if not state.stable:
+            state.stable_count += 1
+            state.closed = state.closed or closed
+            self.changed.add(file_path)
+
+            # Marquer comme stable selon la politique configurée (KAVITA_STABILITY_POLICY)
+            if stability_policy.is_stable(file_path, state, now):
+                state.stable = True
+                folder.pending -= 1
+                logging.info(f"Fichier stable: {file_path}")
+
+        return False
+
+    def forget(self, file_path):
+        """Retire un fichier du suivi et retourne True s'il était suivi"""
+        folder_path, name = os.path.split(file_path)
+        folder = self.folders.get(folder_path)
+        if folder is None:
+            return False
+
+        state = folder.files.pop(name, None)
+        if state is None:
+            return False
+
+        if not state.stable:
+            folder.pending -= 1
+        if not folder.files:
+            del self.folders[folder_path]
+        self._count -= 1
+        self.changed.discard(file_path)
+        self.removed.add(file_path)
+        return True
+
+    def restore(self, file_path, size, mtime, stable_count, stable):
+        """Recharge l'état d'un fichier sauvegardé par JobStore avant un redémarrage"""
+        folder_path, name = os.path.split(file_path)
+        folder = self.folders.get(folder_path)
+        if folder is None:
+            folder = self.folders[folder_path] = FolderState()
+        if name in folder.files:
+            return
+
+        state = folder.files[name] = FileState(size, mtime, time.time())
+        state.stable_count = stable_count
+        state.stable = stable
+        if not stable:
+            folder.pending += 1
+        self._count += 1
+
+    def drain_changes(self):
+        """Retourne et réinitialise les fichiers modifiés et retirés depuis le dernier appel"""
+        changed, removed = self.changed, self.removed
+        self.changed, self.removed = set(), set()
+        return changed, removed
+
+    def forget_tree(self, dir_path):
+        """Retire du suivi tous les fichiers situés dans un dossier et ses sous-dossiers"""
+        prefix = dir_path.rstrip(os.sep) + os.sep
+        for path in [d for d in self.dir_cache if d == dir_path or d.startswith(prefix)]:
+            del self.dir_cache[path]
+
+        forgotten = []
+        for folder_path in [f for f in self.folders if f == dir_path or f.startswith(prefix)]:
+            folder = self.folders.pop(folder_path)
+            self._count -= len(folder.files)
+            forgotten.extend(os.path.join(folder_path, name) for name in folder.files)
+        self.changed.difference_update(forgotten)
+        self.removed.update(forgotten)
+        return forgotten
+
+    def folder_file_paths(self, folder_path):
+        """Retourne les chemins des fichiers suivis dans un dossier"""
+        folder = self.folders.get(folder_path)
+        if folder is None:
+            return []
+        return [os.path.join(folder_path, name) for name in folder.files]
+
+    def stable_folders(self):
+        """Retourne les dossiers dont tous les fichiers sont stables"""
+        return [folder_path for folder_path, folder in self.folders.items() if folder.pending == 0]
+
+    def has_pending(self):
+        """Indique si au moins un fichier suivi est encore instable"""
+        return any(folder.pending for folder in self.folders.values())
+
+    def pending_files(self, folder_path=None):
+        """Retourne les chemins des fichiers encore instables (d'un dossier ou de tout l'index)"""
+        if folder_path is not None:
+            folder = self.folders.get(folder_path)
+            folders = [(folder_path, folder)] if folder is not None else []
+        else:
+            folders = self.folders.items()
+
+        return [
+            os.path.join(path, name)
+            for path, folder in folders if folder.pending
+            for name, state in folder.files.items() if not state.stable
+        ]
+
+# Base SQLite de suivi des fichiers, dans le volume kavita pour survivre aux redémarrages
+STATE_DB = os.environ.get("KAVITA_STATE_DB", f"{BASE_PATH}/.kavita-watcher.db")
+# Nouvelles tentatives des conversions échouées : délai doublé à chaque échec (en secondes)
+RETRY_BASE_DELAY = 60
+MAX_ATTEMPTS = 5
+
+class JobStore:
+    """Suivi persistant des fichiers, de leur détection jusqu'à leur import dans la bibliothèque
+
+    Chaque fichier passe par les états detected -> stable -> staged -> converting -> converted
+    -> moved, ou failed avec une nouvelle tentative différée. La base SQLite (mode WAL) permet de
+    reprendre le traitement après un redémarrage sans repartir de zéro. La clé d'un travail est le
+    chemin courant du fichier : dans download avant le déplacement, dans to_convert ensuite.
+    """
+
+    DETECTED = 'detected'
+    STABLE = 'stable'
+    STAGED = 'staged'
+    CONVERTING = 'converting'
+    CONVERTED = 'converted'
+    MOVED = 'moved'
+    FAILED = 'failed'
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS jobs (
+            path TEXT PRIMARY KEY,
+            state TEXT NOT NULL,
+            size INTEGER NOT NULL DEFAULT 0,
+            mtime REAL NOT NULL DEFAULT 0,
+            stable_count INTEGER NOT NULL DEFAULT 0,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt REAL NOT NULL DEFAULT 0,
+            error TEXT,
+            updated_at REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state);
+        CREATE TABLE IF NOT EXISTS conversions (
+            source_hash TEXT NOT NULL,
+            settings TEXT NOT NULL,
+            output_hash TEXT NOT NULL,
+            output_path TEXT NOT NULL,
+            library_path TEXT,
+            updated_at REAL NOT NULL,
+            PRIMARY KEY (source_hash, settings)
+        );
+        CREATE INDEX IF NOT EXISTS conversions_output_hash ON conversions (output_hash);
+        CREATE INDEX IF NOT EXISTS conversions_output_path ON conversions (output_path);
+    """
+
+    def __init__(self, db_path):
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(self.SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def _write(self, sql, rows):
+        """Exécute une requête d'écriture pour plusieurs lignes dans une seule transaction"""
+        with self._lock, self._conn:
+            self._conn.executemany(sql, rows)
+
+    def _read(self, sql, params=()):
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def sync_detected(self, index):
+        """Enregistre les fichiers du répertoire de téléchargement modifiés depuis la dernière synchronisation"""
+        changed, removed = index.drain_changes()
+        if not changed and not removed:
+            return
+
+        now = time.time()
+        rows = []
+        for file_path in changed:
+            state = index.get(file_path)
+            if state is not None:
+                job_state = self.STABLE if state.stable else self.DETECTED
+                rows.append((file_path, job_state, state.size, state.mtime, state.stable_count, now))
+
+        with self._lock, self._conn:
+            self._conn.executemany(
+                """INSERT INTO jobs (path, state, size, mtime, stable_count, updated_at)
+                   VALUES (?, ?, ?, ?, ?, ?)
+                   ON CONFLICT (path) DO UPDATE SET
+                       state = excluded.state, size = excluded.size, mtime = excluded.mtime,
+                       stable_count = excluded.stable_count, updated_at = excluded.updated_at
+                   WHERE jobs.state IN ('detected', 'stable')""",
+                rows
+            )
+            self._conn.executemany(
+                "DELETE FROM jobs WHERE path = ? AND state IN ('detected', 'stable')",
+                [(file_path,) for file_path in removed]
+            )
+
+    def load_detected(self):
+        """Retourne (chemin, taille, mtime, compteur, stable) des fichiers suivis dans download"""
+        rows = self._read(
+            "SELECT path, size, mtime, stable_count, state FROM jobs WHERE state IN ('detected', 'stable')"
+        )
+        return [(path, size, mtime, count, state == self.STABLE) for path, size, mtime, count, state in rows]
+
+    def stage(self, download_path, staged_path):
+        """Enregistre le déplacement d'un fichier stable vers to_convert"""
+        with self._lock, self._conn:
+            if download_path is not None:
+                self._conn.execute("DELETE FROM jobs WHERE path = ?", (download_path,))
+            self._conn.execute(
+                """INSERT OR REPLACE INTO jobs (path, state, size, mtime, updated_at)
+                   VALUES (?, ?, ?, ?, ?)""",
+                (staged_path, self.STAGED, *self._file_signature(staged_path), time.time())
+            )
+
+    @staticmethod
+    def _file_signature(file_path):
+        try:
+            stat_result = os.stat(file_path)
+        except OSError:
+            return 0, 0
+        return stat_result.st_size, stat_result.st_mtime
+
+    def set_state(self, paths, state):
+        """Change l'état de plusieurs travaux"""
+        now = time.time()
+        self._write(
+            "UPDATE jobs SET state = ?, updated_at = ? WHERE path = ?",
+            [(state, now, path) for path in paths]
+        )
+
+    def mark_failed(self, path, error):
+        """Enregistre l'échec d'une conversion et programme la prochaine tentative
+
+        Retourne True si une nouvelle tentative aura lieu.
+        """
+        with self._lock, self._conn:
+            row = self._conn.execute("SELECT attempts FROM jobs WHERE path = ?", (path,)).fetchone()
+            attempts = (row[0] if row else 0) + 1
+            next_attempt = time.time() + RETRY_BASE_DELAY * 2 ** (attempts - 1)
+            self._conn.execute(
+                """UPDATE jobs SET state = ?, attempts = ?, next_attempt = ?, error = ?, updated_at = ?
+                   WHERE path = ?""",
+                (self.FAILED, attempts, next_attempt, error, time.time(), path)
+            )
+        return attempts < MAX_ATTEMPTS
+
+    def take_due_retries(self):
+        """Repasse en staged les travaux échoués dont le délai d'attente est écoulé et les retourne"""
+        now = time.time()
+        with self._lock, self._conn:
+            paths = [row[0] for row in self._conn.execute(
+                "SELECT path FROM jobs WHERE state = ? AND attempts < ? AND next_attempt <= ?",
+                (self.FAILED, MAX_ATTEMPTS, now)
+            )]
+            self._conn.executemany(
+                "UPDATE jobs SET state = ?, updated_at = ? WHERE path = ?",
+                [(self.STAGED, now, path) for path in paths]
+            )
+        return paths
+
+    def has_pending_retries(self):
+        """Indique si des conversions échouées doivent encore être retentées"""
+        return bool(self._read(
+            "SELECT 1 FROM jobs WHERE state = ? AND attempts < ? LIMIT 1", (self.FAILED, MAX_ATTEMPTS)
+        ))
+
+    def has_unfinished_jobs(self, folder):
+        """Indique si des fichiers d'un dossier de to_convert sont encore en attente ou en conversion"""
+        prefix = folder.rstrip(os.sep) + os.sep
+        return bool(self._read(
+            """SELECT 1 FROM jobs WHERE substr(path, 1, ?) = ?
+                   AND (state IN (?, ?) OR (state = ? AND attempts < ?)) LIMIT 1""",
+            (len(prefix), prefix, self.STAGED, self.CONVERTING, self.FAILED, MAX_ATTEMPTS)
+        ))
+
+    def paths_under(self, folder, *states):
+        """Retourne les chemins des travaux d'un dossier de to_convert dans l'un des états donnés"""
+        prefix = folder.rstrip(os.sep) + os.sep
+        placeholders = ", ".join("?" * len(states))
+        return [row[0] for row in self._read(
+            f"SELECT path FROM jobs WHERE substr(path, 1, ?) = ? AND state IN ({placeholders})",
+            (len(prefix), prefix, *states)
+        )]
+
+    def paths_in_state(self, *states):
+        """Retourne les chemins des travaux dans l'un des états donnés"""
+        placeholders = ", ".join("?" * len(states))
+        return [row[0] for row in self._read(f"SELECT path FROM jobs WHERE state IN ({placeholders})", states)]
+
+    def delete(self, paths):
+        """Oublie des travaux terminés ou dont le fichier a disparu"""
+        self._write("DELETE FROM jobs WHERE path = ?", [(path,) for path in paths])
+
+    def lookup_conversion(self, source_hash, settings):
+        """Retourne le CBZ de la bibliothèque déjà produit pour ce contenu et ces réglages, ou None"""
+        rows = self._read(
+            "SELECT library_path FROM conversions WHERE source_hash = ? AND settings = ?",
+            (source_hash, settings)
+        )
+        return rows[0][0] if rows else None
+
+    def find_output(self, output_hash):
+        """Retourne les (chemin dans cbz_convert, chemin dans la bibliothèque) des CBZ de ce contenu"""
+        return self._read(
+            "SELECT DISTINCT output_path, library_path FROM conversions WHERE output_hash = ?",
+            (output_hash,)
+        )
+
+    def record_conversion(self, source_hash, settings, output_hash, output_path, library_path=None):
+        """Associe le contenu d'un fichier source au CBZ produit"""
+        self._write(
+            """INSERT INTO conversions (source_hash, settings, output_hash, output_path, library_path, updated_at)
+               VALUES (?, ?, ?, ?, ?, ?)
+               ON CONFLICT (source_hash, settings) DO UPDATE SET
+                   output_hash = excluded.output_hash, output_path = excluded.output_path,
+                   library_path = excluded.library_path, updated_at = excluded.updated_at""",
+            [(source_hash, settings, output_hash, output_path, library_path, time.time())]
+        )
+
+    def record_library_paths(self, moves):
+        """Enregistre l'emplacement final des CBZ importés : [(chemin dans cbz_convert, chemin final)]"""
+        now = time.time()
+        self._write(
+            "UPDATE conversions SET library_path = ?, updated_at = ? WHERE output_path = ? AND library_path IS NULL",
+            [(library_path, now, output_path) for output_path, library_path in moves]
+        )
+
+def detect_memory_budget():
+    """Retourne 75 % de la mémoire disponible pour le conteneur (limite cgroup, sinon RAM), en Mo"""
+    limit = None
+    for path in ("/sys/fs/cgroup/memory.max", "/sys/fs/cgroup/memory/memory.limit_in_bytes"):
+        try:
+            with open(path) as f:
+                value = f.read().strip()
+        except OSError:
+            continue
+        if value.isdigit() and int(value) < 1 << 60:
+            limit = int(value) // (1024 * 1024)
+        break
+    
+    if limit is None:
+        try:
+            with open("/proc/meminfo") as f:
+                for line in f:
+                    if line.startswith("MemTotal:"):
+                        limit = int(line.split()[1]) // 1024
+                        break
+        except (OSError, ValueError):
+            pass
+    
+    return max(256, (limit or 4096) * 3 // 4)
+
+# Budget de l'ordonnanceur de conversions : mémoire (en Mo) et processus de conversion simultanés
+MEMORY_BUDGET_MB = int(os.environ.get("KAVITA_MEMORY_BUDGET_MB", 0)) or detect_memory_budget()
+CPU_BUDGET = max(1, int(os.environ.get("KAVITA_CPU_BUDGET", os.cpu_count() or 1)))
+# Mémoire estimée d'un processus pdftoppm (150 dpi) et d'un processus cbconvert, en Mo
+PDFTOPPM_MEMORY_MB = 150
+CBCONVERT_MEMORY_MB = 200
+# Taille moyenne d'une page, pour estimer le nombre de pages d'un fichier à partir de sa taille
+AVERAGE_PAGE_BYTES = 300 * 1024
+# Vieillissement : chaque seconde d'attente retire une page au coût d'un travail
+AGING_PAGES_PER_SECOND = 1.0
+# Au-delà de cette attente (en secondes), le travail prioritaire qui ne tient pas dans le budget
+# n'est plus doublé par des travaux plus petits : on attend que le budget se libère pour lui
+MAX_BYPASS_WAIT = 120
+
+class ConversionJob:
+    """Travail en attente dans ConversionScheduler"""
+    __slots__ = ('path', 'pages', 'memory', 'cpu', 'queued_at', 'priority', 'taken')
+
+    def __init__(self, path, pages, memory, cpu, queued_at):
+        self.path = path
+        self.pages = pages
+        self.memory = memory
+        self.cpu = cpu
+        self.queued_at = queued_at
+        # Coût vieilli : pages - AGING_PAGES_PER_SECOND * attente. Le terme dépendant de l'heure
+        # courante est le même pour tous les travaux, l'ordre du tas reste donc valable
+        self.priority = pages + AGING_PAGES_PER_SECOND * queued_at
+        # Travail retiré hors du sommet du tas : laissé en place et ignoré quand il y remonte
+        self.taken = False
+
+    def __lt__(self, other):
+        return (self.priority, self.path) < (other.priority, other.path)
+
+def estimate_job(file_path):
+    """Estime (pages, mémoire en Mo, processus) de la conversion d'un fichier
+
+    L'estimation ne dépend que de la taille du fichier : elle est faite depuis la boucle de
+    surveillance, qui ne doit jamais attendre un outil externe (pdfinfo sur un PDF malformé...).
+    """
+    try:
+        size = os.path.getsize(file_path)
+    except OSError:
+        size = 0
+    pages = max(1, size // AVERAGE_PAGE_BYTES)
+    
+    if file_path.lower().endswith('.pdf'):
+        processes = min(PDF_PAGE_WORKERS, -(-pages // PDF_CHUNK_PAGES))
+        return pages, processes * PDFTOPPM_MEMORY_MB, processes
+    
+    return pages, CBCONVERT_MEMORY_MB + size // (1024 * 1024), 1
+
+class ConversionScheduler:
+    """File de conversion : plus court d'abord avec vieillissement, et contrôle d'admission
+
+    Remplace une queue.Queue (put, get, get_nowait, qsize). Chaque travail est estimé à l'ajout
+    (nombre de pages, mémoire, processus) ; get() attend qu'un travail tienne dans le budget
+    restant et rend le moins coûteux après vieillissement. Un travail qui dépasse à lui seul le
+    budget est lancé seul. Les workers appellent release() à la fin de chaque conversion.
+    """
+
+    def __init__(self, memory_budget, cpu_budget):
+        self.memory_budget = memory_budget
+        self.cpu_budget = cpu_budget
+        self._cond = threading.Condition()
+        self._heap = []
+        self._queued = set()
+        self._running = {}  # chemin -> ConversionJob
+        self._memory_used = 0
+        self._cpu_used = 0
+
+    def qsize(self):
+        with self._cond:
+            return len(self._queued)
+
+    def put(self, file_path):
+        """Ajoute un fichier à convertir (ignoré s'il est déjà en attente)"""
+        with self._cond:
+            if file_path in self._queued:
+                return
+        pages, memory, cpu = estimate_job(file_path)
+        with self._cond:
+            if file_path in self._queued:
+                return
+            heapq.heappush(self._heap, ConversionJob(file_path, pages, memory, cpu, time.monotonic()))
+            self._queued.add(file_path)
+            self._cond.notify()
+
+    def _fits(self, job):
+        if not self._running:
+            return True
+        return (self._memory_used + job.memory <= self.memory_budget
+                and self._cpu_used + job.cpu <= self.cpu_budget)
+
+    def _discard_taken(self):
+        """Retire du sommet du tas les travaux déjà pris par contournement"""
+        while self._heap and self._heap[0].taken:
+            heapq.heappop(self._heap)
+
+    def _select(self):
+        """Retourne le travail à lancer maintenant, ou None"""
+        self._discard_taken()
+        if not self._heap:
+            return None
+        head = self._heap[0]
+        if self._fits(head):
+            return head
+        if time.monotonic() - head.queued_at >= MAX_BYPASS_WAIT:
+            return None
+        fitting = [job for job in self._heap if not job.taken and self._fits(job)]
+        return min(fitting) if fitting else None
+
+    def _take(self, job):
+        """Retire un travail de la file : dépilé s'il est au sommet, sinon marqué (suppression paresseuse)"""
+        if self._heap[0] is job:
+            heapq.heappop(self._heap)
+        else:
+            job.taken = True
+        self._queued.discard(job.path)
+        self._discard_taken()
+
+    def get(self):
+        """Attend et réserve le prochain travail admissible, puis retourne son chemin"""
+        with self._cond:
+            while True:
+                job = self._select()
+                if job is not None:
+                    break
+                # Le délai MAX_BYPASS_WAIT peut expirer sans notification : revérifier régulièrement
+                self._cond.wait(timeout=5)
+            
+            self._take(job)
+            self._running[job.path] = job
+            self._memory_used += job.memory
+            self._cpu_used += job.cpu
+            if job.memory > self.memory_budget:
+                logging.warning(f"Conversion de {job.path} au-delà du budget mémoire ({job.memory} Mo), lancée seule")
+            return job.path
+
+    def get_nowait(self):
+        """Retire le prochain travail sans réservation (conversion hors pipeline)"""
+        with self._cond:
+            self._discard_taken()
+            if not self._heap:
+                raise queue.Empty
+            job = self._heap[0]
+            self._take(job)
+            return job.path
+
+    def usage(self):
+        """Retourne (travaux en cours, mémoire réservée en Mo, processus réservés)"""
+        with self._cond:
+            return len(self._running), self._memory_used, self._cpu_used
+
+    def release(self, file_path):
+        """Libère le budget réservé par un travail terminé"""
+        with self._cond:
+            job = self._running.pop(file_path, None)
+            if job is not None:
+                self._memory_used -= job.memory
+                self._cpu_used -= job.cpu
+                self._cond.notify_all()
+
 # Variables pour la détection de fichiers
-detected_files = {}  # Dictionnaire pour suivre les fichiers détectés et leur stabilité
-folder_files = {}    # Dictionnaire pour suivre les fichiers par dossier
-files_to_process = [] # Liste des fichiers à traiter dans le cycle courant
-processing_lock = threading.Lock()  # Verrou pour éviter des traitements concurrents
-conversion_in_progress = False  # Indicateur pour suivre si une conversion est en cours
+detected_files = FileIndex()  # Index des fichiers détectés et de leur stabilité, par dossier
+job_store = None  # JobStore ouvert au démarrage par main()
+
+# Files entre les étapes du pipeline : détection -> déplacement -> conversion -> import -> nettoyage
+convert_queue = ConversionScheduler(MEMORY_BUDGET_MB, CPU_BUDGET)  # fichiers de to_convert en attente de conversion
+import_queue = queue.Queue()   # dossiers de série de to_convert dont une conversion vient de se terminer
+# Sérialise les ajouts dans to_convert et le début et la fin de l'import des séries : une série ne
+# peut pas recevoir de nouveau fichier pendant son import, ni perdre un dossier vide au moment où
+# on le remplit
+to_convert_lock = threading.Lock()
+# Dossiers de série de to_convert en cours d'import (protégé par to_convert_lock) : leurs nouveaux
+# fichiers restent dans download jusqu'à la fin de l'import, les autres séries continuent d'avancer
+importing_series = set()
 
 # Extensions à ignorer
 IGNORED_EXTENSIONS = ['.parts']
 
-def run_command(command, cwd=None):
-    """Exécute une commande shell et affiche la sortie"""
+# Mode de surveillance : "auto" (inotify si disponible, sinon polling), "inotify" ou "poll"
+WATCH_MODE = os.environ.get("KAVITA_WATCH_MODE", "auto").lower()
+# Intervalle entre deux scans complets de download (en secondes) ; les fichiers instables sont
+# revérifiés toutes les `stability_policy.check_interval` secondes
+SCAN_INTERVAL = 30
+
+if STABILITY_POLICY == "count":
+    stability_policy = CountPolicy()
+else:
+    stability_policy = AdaptivePolicy()
+
+# Nombre maximal de conversions simultanées (une conversion = un processus pdftoppm ou cbconvert)
+CONVERSION_WORKERS = max(1, int(os.environ.get("KAVITA_CONVERSION_WORKERS", os.cpu_count() or 1)))
+# Taille des blocs des copies entre systèmes de fichiers différents
+COPY_CHUNK_SIZE = 8 * 1024 * 1024
+# Suffixe de la copie en cours : le fichier n'apparaît sous son nom définitif qu'une fois vérifié
+COPY_TEMP_SUFFIX = ".copying"
+
+# Nombre maximal de fichiers en attente de conversion : au-delà, les dossiers stables restent
+# dans download jusqu'à ce que les workers rattrapent leur retard
+CONVERT_QUEUE_LIMIT = max(1, int(os.environ.get("KAVITA_CONVERT_QUEUE_LIMIT", 64)))
+# Nombre de processus pdftoppm lancés en parallèle sur des plages de pages d'un même PDF (1 = séquentiel)
+PDF_PAGE_WORKERS = max(1, int(os.environ.get("KAVITA_PDF_PAGE_WORKERS", os.cpu_count() or 1)))
+# Nombre de pages rasterisées par appel à pdftoppm : borne l'espace temporaire utilisé par PDF
+PDF_CHUNK_PAGES = max(1, int(os.environ.get("KAVITA_PDF_CHUNK_PAGES", 4)))
+
+# Numéro de page dans les noms de fichiers produits par pdftoppm (page-007.jpg)
+PAGE_NUMBER_PATTERN = re.compile(r'-(\d+)\.jpe?g$')
+# Numéro de page dans les noms de fichiers produits par pdfimages -p (page-007-000.jpg)
+EXTRACTED_PAGE_PATTERN = re.compile(r'-(\d+)-\d+\.(?:jpg|png)$')
+# Numéro de volume dans un nom de fichier : "v05", "Vol. 5", "Volume 5", "T05", "Tome 5", "#5",
+# ou nombre d'au plus trois chiffres en fin de nom ("Naruto 05", "Naruto_05") ; le nom de la série
+# est retiré avant la recherche (voir parse_volume_number)
+VOLUME_NUMBER_PATTERN = re.compile(
+    r'(?:(?<![A-Za-z])(?:v|vol|volume|t|tome)\.?\s*|#)(\d{1,4})(?!\d)|(?:^|(?<=[\s_-]))(\d{1,3})$',
+    re.IGNORECASE
+)
+# Dimensions des pages dans la sortie de pdfinfo -f/-l (Page    1 size: 595 x 842 pts (A4))
+PAGE_SIZE_PATTERN = re.compile(r'^Page\s+(\d+) size:\s+([\d.]+) x ([\d.]+) pts', re.MULTILINE)
+# Rotation des pages dans la même sortie (Page    1 rot:  90)
+PAGE_ROTATION_PATTERN = re.compile(r'^Page\s+(\d+) rot:\s+(-?\d+)', re.MULTILINE)
+
+# Extraction directe des images d'origine pour les pages scannées, sans rasterisation
+PDF_PASSTHROUGH = os.environ.get("KAVITA_PDF_PASSTHROUGH", "1") == "1"
+# Images extraites telles quelles par pdfimages -all (jpeg -> .jpg, image -> .png)
+PASSTHROUGH_ENCODINGS = {'jpeg', 'image'}
+PASSTHROUGH_COLORS = {'gray', 'rgb', 'index'}
+# Part minimale de la page que l'image doit couvrir pour la remplacer entièrement
+PASSTHROUGH_MIN_COVERAGE = 0.9
+
+class EncodingProfile:
+    """Réglages d'encodage des pages d'une catégorie
+
+    - format : jpeg, webp ou avif (pdftoppm ne produit que du JPEG : les PDF restent en JPEG)
+    - max_edge : plus grand côté d'une page en pixels ; la résolution de rasterisation des PDF
+      en est déduite à partir de la taille des pages, sans dépasser max_dpi
+    - quality : qualité de départ, ajustée entre min_quality et max_quality pour approcher
+      target_kb kilo-octets par page (0 = pas de cible) ; 0 garde la qualité historique des
+      outils (défaut de libjpeg pour pdftoppm, CBCONVERT_DEFAULT_QUALITY pour cbconvert)
+    """
+    __slots__ = ('format', 'max_edge', 'max_dpi', 'quality', 'min_quality', 'max_quality', 'target_kb')
+    FORMATS = ('jpeg', 'webp', 'avif')
+
+    def __init__(self, format='jpeg', max_edge=2400, max_dpi=200, quality=85, min_quality=60,
+                 max_quality=92, target_kb=0):
+        self.format = format
+        self.max_edge = max_edge
+        self.max_dpi = max_dpi
+        self.quality = quality
+        self.min_quality = min_quality
+        self.max_quality = max_quality
+        self.target_kb = target_kb
+
+    @classmethod
+    def parse(cls, spec, default):
+        """Lit une description "format=webp,max_edge=1600,target_kb=300" à partir d'un profil par défaut"""
+        values = {name: getattr(default, name) for name in cls.__slots__}
+        for item in filter(None, (part.strip() for part in spec.split(','))):
+            name, _, value = item.partition('=')
+            name = name.strip()
+            if name not in values:
+                logging.warning(f"Paramètre de profil d'encodage inconnu ignoré: {name}")
+                continue
+            if name == 'format':
+                values[name] = value.strip().lower()
+                continue
+            try:
+                values[name] = int(value)
+            except ValueError:
+                logging.warning(f"Valeur invalide pour {name} dans le profil d'encodage: {value!r}, "
+                                f"utilisation de {values[name]}")
+        if values['format'] not in cls.FORMATS:
+            logging.warning(f"Format d'image inconnu {values['format']}, utilisation de jpeg")
+            values['format'] = 'jpeg'
+        return cls(**values)
+
+    def key(self):
+        """Description stable du profil, incluse dans la clé du cache de conversion"""
+        return ",".join(f"{name}={getattr(self, name)}" for name in self.__slots__)
+
+# Profils par défaut : pages de manga majoritairement en niveaux de gris et lues sur mobile,
+# comics et BD en couleur sur des pages plus grandes. Surcharge : KAVITA_PROFILE_<CATÉGORIE>
+DEFAULT_PROFILES = {
+    'manga': EncodingProfile(max_edge=1800, max_dpi=150, target_kb=350),
+    'comics': EncodingProfile(max_edge=2400, max_dpi=200, target_kb=600),
+    'bd': EncodingProfile(max_edge=2400, max_dpi=200, target_kb=600),
+}
+ENCODING_PROFILES = {
+    category: EncodingProfile.parse(os.environ.get(f"KAVITA_PROFILE_{category.upper()}", ""), default)
+    for category, default in DEFAULT_PROFILES.items()
+}
+# Fichiers hors catégorie : réglages historiques (150 dpi, qualité par défaut de pdftoppm,
+# qualité 85 pour cbconvert)
+FALLBACK_PROFILE = EncodingProfile(max_edge=0, max_dpi=150, quality=0)
+# Qualité passée à cbconvert pour un profil sans qualité (quality=0)
+CBCONVERT_DEFAULT_QUALITY = 85
+# Écart toléré autour de la cible de taille avant d'ajuster la qualité
+TARGET_TOLERANCE = 0.2
+
+# Durée maximale (en secondes) d'une commande externe, et d'une conversion complète
+COMMAND_TIMEOUT = float(os.environ.get("KAVITA_COMMAND_TIMEOUT", 900))
+JOB_TIMEOUT = float(os.environ.get("KAVITA_JOB_TIMEOUT", 7200))
+# Durée maximale (en secondes) d'un outil d'inspection (pdfinfo, pdffonts, pdfimages -list)
+PROBE_TIMEOUT = float(os.environ.get("KAVITA_PROBE_TIMEOUT", 60))
+# Priorité CPU (nice) et E/S (ionice best-effort, 0 à 7) des outils de conversion
+CONVERSION_NICE = int(os.environ.get("KAVITA_CONVERSION_NICE", 10))
+CONVERSION_IONICE = 7
+# Lignes de sortie d'une commande recopiées dans le journal, longueur maximale d'une ligne,
+# et dernières lignes conservées pour être affichées en cas d'échec
+OUTPUT_LINE_LIMIT = 50
+OUTPUT_LINE_LENGTH = 500
+OUTPUT_TAIL_LINES = 20
+# Numéro de l'appel système ioprio_set selon l'architecture
+IOPRIO_SET_SYSCALLS = {'x86_64': 251, 'aarch64': 30, 'armv7l': 314, 'i686': 289}
+
+class JobContext:
+    """Contexte d'une conversion : échéance, annulation et ressources consommées
+
+    Les commandes lancées pour le travail (run_command) s'y enregistrent : cancel() tue leurs
+    groupes de processus, et leur consommation (temps CPU, RSS maximal) y est cumulée.
+    """
+
+    def __init__(self, name, timeout=None):
+        self.name = name
+        self.started = time.monotonic()
+        self.deadline = self.started + timeout if timeout else None
+        self.cancelled = threading.Event()
+        self.reason = None
+        self.commands = 0
+        self.cpu_time = 0.0
+        self.peak_rss_kb = 0
+        self._lock = threading.Lock()
+        self._processes = set()
+
+    def remaining(self):
+        """Retourne le temps restant avant l'échéance, ou None sans échéance"""
+        if self.deadline is None:
+            return None
+        return self.deadline - time.monotonic()
+
+    def cancel(self, reason):
+        """Annule le travail et tue les commandes en cours"""
+        with self._lock:
+            if self.cancelled.is_set():
+                return
+            self.reason = reason
+            self.cancelled.set()
+            processes = list(self._processes)
+        logging.warning(f"Annulation de {self.name}: {reason}")
+        for process in processes:
+            process.kill()
+
+    def attach(self, process):
+        """Enregistre une commande ; retourne False si le travail est déjà annulé"""
+        with self._lock:
+            if self.cancelled.is_set():
+                return False
+            self._processes.add(process)
+            return True
+
+    def detach(self, process, rusage=None):
+        """Retire une commande terminée et cumule sa consommation (rusage de os.wait4)"""
+        with self._lock:
+            self._processes.discard(process)
+            self.commands += 1
+            if rusage is not None:
+                self.cpu_time += rusage.ru_utime + rusage.ru_stime
+                self.peak_rss_kb = max(self.peak_rss_kb, rusage.ru_maxrss)
+
+    def summary(self):
+        return (
+            f"{time.monotonic() - self.started:.1f}s, {self.commands} commandes, "
+            f"CPU {self.cpu_time:.1f}s, RSS max {self.peak_rss_kb // 1024} Mo"
+        )
+
+# Travaux de conversion en cours, annulés à l'arrêt du conteneur
+running_jobs = set()
+running_jobs_lock = threading.Lock()
+shutting_down = threading.Event()
+
+def cancel_running_jobs(reason):
+    """Annule toutes les conversions en cours"""
+    with running_jobs_lock:
+        jobs = list(running_jobs)
+    for job in jobs:
+        job.cancel(reason)
+
+class RunningProcess:
+    """Processus lancé par run_command, dans son propre groupe pour être tué avec ses enfants"""
+
+    def __init__(self, popen):
+        self.popen = popen
+        self.killed = False
+        self._reaped = False
+        self._lock = threading.Lock()
+
+    def kill(self):
+        with self._lock:
+            if self._reaped or self.killed:
+                return
+            self.killed = True
+            try:
+                os.killpg(self.popen.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+
+    def reap(self):
+        """Attend la fin du processus et retourne (code de sortie, rusage)"""
+        _, status, rusage = os.wait4(self.popen.pid, 0)
+        with self._lock:
+            self._reaped = True
+        self.popen.returncode = os.waitstatus_to_exitcode(status)
+        return self.popen.returncode, rusage
+
+thread_priority = threading.local()
+
+def lower_thread_priority():
+    """Abaisse une fois pour toutes la priorité CPU et E/S du thread courant
+
+    Sous Linux, nice et ionice s'appliquent au thread et sont hérités par les processus qu'il
+    lance : les outils de conversion tournent ainsi en arrière-plan sans ralentir la
+    surveillance, et sans la fenêtre de course d'un réglage appliqué après le lancement.
+    """
+    if getattr(thread_priority, 'lowered', False):
+        return
+    thread_priority.lowered = True
+    tid = threading.get_native_id()
+    
+    try:
+        os.setpriority(os.PRIO_PROCESS, tid, max(os.getpriority(os.PRIO_PROCESS, tid), CONVERSION_NICE))
+    except OSError as e:
+        logging.warning(f"Impossible d'abaisser la priorité CPU: {e}")
+    
+    syscall_number = IOPRIO_SET_SYSCALLS.get(platform.machine())
+    if syscall_number is not None:
+        # IOPRIO_WHO_PROCESS = 1, IOPRIO_CLASS_BE = 2, valeur = classe << 13 | niveau
+        libc = ctypes.CDLL(None, use_errno=True)
+        if libc.syscall(syscall_number, 1, tid, (2 << 13) | CONVERSION_IONICE) != 0:
+            logging.warning(f"Impossible d'abaisser la priorité E/S: {os.strerror(ctypes.get_errno())}")
+
+def run_command(argv, cwd=None, job=None, timeout=COMMAND_TIMEOUT):
+    """Exécute un outil externe sans shell et retourne True en cas de succès
+
+    La sortie (stdout et stderr) est lue ligne par ligne et recopiée dans le journal dans la
+    limite de OUTPUT_LINE_LIMIT lignes. La commande est tuée (avec ses enfants) si elle dépasse
+    `timeout` secondes ou l'échéance du travail `job`, ou si le travail est annulé.
+    """
+    command = shlex.join(argv)
+    name = os.path.basename(argv[0])
+    
+    if job is not None:
+        remaining = job.remaining()
+        if remaining is not None and remaining <= 0:
+            job.cancel("durée maximale de conversion dépassée")
+        if job.cancelled.is_set():
+            logging.error(f"Commande non lancée, travail annulé: {command}")
+            return False
+        if remaining is not None and remaining < timeout:
+            timeout = remaining
+    
     logging.info(f"Exécution de la commande: {command}")
+    lower_thread_priority()
+    started = time.monotonic()
+    try:
+        popen = subprocess.Popen(
+            argv,
+            cwd=cwd,
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            start_new_session=True
+        )
+    except OSError as e:
+        logging.error(f"Impossible de lancer {name}: {e}")
+        return False
+    
+    process = RunningProcess(popen)
+    if job is not None and not job.attach(process):
+        process.kill()
+    watchdog = threading.Timer(timeout, process.kill)
+    watchdog.daemon = True
+    watchdog.start()
+    
+    logged_lines = 0
+    dropped_lines = 0
+    tail = deque(maxlen=OUTPUT_TAIL_LINES)
+    rusage = None
+    try:
+        with popen.stdout:
+            while True:
+                line = popen.stdout.readline(OUTPUT_LINE_LENGTH)
+                if not line:
+                    break
+                text = line.decode(errors='replace').rstrip()
+                if not text:
+                    continue
+                if logged_lines < OUTPUT_LINE_LIMIT:
+                    logging.info(f"[{name}] {text}")
+                    logged_lines += 1
+                else:
+                    dropped_lines += 1
+                    tail.append(text)
+        returncode, rusage = process.reap()
+    finally:
+        watchdog.cancel()
+        if process.popen.returncode is None:
+            # Lecture interrompue par une exception : ne pas laisser de processus orphelin
+            process.kill()
+            process.reap()
+        if job is not None:
+            job.detach(process, rusage)
+    
+    if dropped_lines:
+        logging.info(f"[{name}] {dropped_lines} lignes de sortie non affichées")
+    
+    elapsed = time.monotonic() - started
+    logging.info(
+        f"Fin de {name} (code {returncode}) en {elapsed:.1f}s, "
+        f"CPU {rusage.ru_utime + rusage.ru_stime:.1f}s, RSS max {rusage.ru_maxrss // 1024} Mo"
+    )
+    
+    if process.killed:
+        reason = job.reason if job is not None and job.cancelled.is_set() else f"délai de {timeout:.0f}s dépassé"
+        logging.error(f"Commande interrompue ({reason}): {command}")
+        return False
+    if returncode != 0:
+        logging.error(f"Erreur lors de l'exécution de la commande (code {returncode}): {command}")
+        for text in tail:
+            logging.error(f"[{name}] {text}")
+        return False
+    return True
+
+class MoveStats:
+    """Compteurs des déplacements de fichiers, pour mesurer l'amplification d'E/S
+
+    Un déplacement sur un même système de fichiers (rename ou lien physique) ne copie aucun octet ;
+    seuls les déplacements entre points de montage différents sont comptés dans copied_bytes.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.renamed = 0
+        self.linked = 0
+        self.copied = 0
+        self.copied_bytes = 0
+
+    def add(self, method, copied_bytes=0):
+        with self._lock:
+            setattr(self, method, getattr(self, method) + 1)
+            self.copied_bytes += copied_bytes
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'renamed': self.renamed,
+                'linked': self.linked,
+                'copied': self.copied,
+                'copied_bytes': self.copied_bytes,
+            }
+
+move_stats = MoveStats()
+
+class CacheStats:
+    """Compteurs du cache de conversion : sources déjà importées (hits), conversions (misses)
+    et CBZ produits identiques à un CBZ existant (duplicates)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.duplicates = 0
+
+    def add(self, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def snapshot(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'duplicates': self.duplicates}
+
+cache_stats = CacheStats()
+
+# Port HTTP de l'endpoint Prometheus /metrics (0 = désactivé)
+METRICS_PORT = int(os.environ.get("KAVITA_METRICS_PORT", 9110))
+
+def escape_metric_text(text, quote=False):
+    """Échappe une valeur de label (quote=True) ou un texte d'aide selon le format texte Prometheus"""
+    text = str(text).replace('\\', '\\\\').replace('\n', '\\n')
+    return text.replace('"', '\\"') if quote else text
+
+class Metrics:
+    """Compteurs, jauges et sommes exposés au format texte Prometheus
+
+    Une mesure "summary" est exposée sous la forme <nom>_sum et <nom>_count : Prometheus en
+    déduit les durées moyennes et les débits (rate(x_sum) / rate(x_count)).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._descriptions = {}  # nom -> (type, aide)
+        self._values = {}        # (nom de l'échantillon, labels triés) -> valeur
+
+    def describe(self, name, kind, help_text):
+        self._descriptions[name] = (kind, help_text)
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        with self._lock:
+            self._values[(name, tuple(sorted(labels.items())))] = value
+
+    def observe(self, name, value, **labels):
+        """Ajoute une observation à une mesure de type summary"""
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[(f"{name}_sum", key)] = self._values.get((f"{name}_sum", key), 0) + value
+            self._values[(f"{name}_count", key)] = self._values.get((f"{name}_count", key), 0) + 1
+
+    def render(self):
+        """Retourne toutes les mesures au format d'exposition texte de Prometheus"""
+        with self._lock:
+            values = sorted(self._values.items())
+        
+        samples = {}
+        for (sample, labels), value in values:
+            base = sample
+            for suffix in ('_sum', '_count'):
+                if sample.endswith(suffix) and sample[:-len(suffix)] in self._descriptions:
+                    base = sample[:-len(suffix)]
+            samples.setdefault(base, []).append((sample, labels, value))
+        
+        lines = []
+        for name, (kind, help_text) in sorted(self._descriptions.items()):
+            lines.append(f"# HELP {name} {escape_metric_text(help_text)}")
+            lines.append(f"# TYPE {name} {kind}")
+            for sample, labels, value in samples.get(name, []):
+                label_text = ",".join(f'{key}="{escape_metric_text(value_, quote=True)}"' for key, value_ in labels)
+                lines.append(f"{sample}{{{label_text}}} {value}" if label_text else f"{sample} {value}")
+        return "\n".join(lines) + "\n"
+
+metrics = Metrics()
+metrics.describe("kavita_scan_duration_seconds", "summary", "Durée des scans du répertoire de téléchargement")
+metrics.describe("kavita_tracked_files", "gauge", "Fichiers suivis dans download")
+metrics.describe("kavita_unstable_files", "gauge", "Fichiers de download encore en cours d'écriture")
+metrics.describe("kavita_queue_depth", "gauge", "Éléments en attente par étape du pipeline")
+metrics.describe("kavita_conversions_running", "gauge", "Conversions en cours")
+metrics.describe("kavita_conversion_memory_reserved_mb", "gauge", "Mémoire réservée par l'ordonnanceur de conversions")
+metrics.describe("kavita_stage_duration_seconds", "summary", "Durée des étapes du pipeline (staging, import)")
+metrics.describe("kavita_conversion_duration_seconds", "summary", "Durée des conversions réussies, par méthode")
+metrics.describe("kavita_conversion_cpu_seconds_total", "counter", "Temps CPU des outils de conversion, par méthode")
+metrics.describe("kavita_conversion_pages_total", "counter", "Pages produites par les conversions, par méthode")
+metrics.describe("kavita_conversion_bytes_in_total", "counter", "Octets des fichiers source convertis, par méthode")
+metrics.describe("kavita_conversion_bytes_out_total", "counter", "Octets des CBZ produits, par méthode")
+metrics.describe("kavita_conversion_pages_per_second", "gauge", "Débit de la dernière conversion, par méthode")
+metrics.describe("kavita_conversion_failures_total", "counter", "Conversions en échec, par méthode")
+metrics.describe("kavita_import_failures_total", "counter", "Imports de série en échec")
+metrics.describe("kavita_duplicate_volumes_total", "counter", "Volumes déjà présents dans la bibliothèque, mis en quarantaine")
+metrics.describe("kavita_library_scans_total", "counter", "Demandes de scan Kavita, par résultat")
+metrics.describe("kavita_conversion_cache_total", "counter", "Résultats du cache de conversion")
+metrics.describe("kavita_moves_total", "counter", "Fichiers et dossiers déplacés, par méthode")
+metrics.describe("kavita_moved_bytes_copied_total", "counter", "Octets copiés par les déplacements entre systèmes de fichiers")
+
+def device_of(path):
+    """Retourne le périphérique (st_dev) d'un chemin, ou de son premier parent existant"""
+    while True:
+        try:
+            return os.stat(path).st_dev
+        except FileNotFoundError:
+            parent = os.path.dirname(path)
+            if parent == path:
+                raise
+            path = parent
+
+def plan_move(src, dest):
+    """Choisit la méthode de déplacement : 'rename' sur un même périphérique, 'copy' sinon"""
+    return 'rename' if os.stat(src).st_dev == device_of(os.path.dirname(dest)) else 'copy'
+
+def move_without_copy(src, dest, replace):
+    """Déplace un fichier par rename ou lien physique ; retourne False si la source et la
+    destination sont sur deux points de montage différents (EXDEV)"""
+    try:
+        if replace:
+            os.rename(src, dest)
+            move_stats.add('renamed')
+            return True
+        
+        # Lien physique puis suppression : échoue si la destination existe, sans course possible
+        try:
+            os.link(src, dest)
+        except FileExistsError:
+            raise
+        except OSError as e:
+            if e.errno == errno.EXDEV:
+                raise
+            # Système de fichiers sans liens physiques
+            if os.path.lexists(dest):
+                raise FileExistsError(errno.EEXIST, os.strerror(errno.EEXIST), dest)
+            os.rename(src, dest)
+            move_stats.add('renamed')
+            return True
+        os.unlink(src)
+        move_stats.add('linked')
+        return True
+    except OSError as e:
+        if e.errno == errno.EXDEV:
+            return False
+        raise
+
+def file_crc32(path):
+    """Calcule le CRC32 d'un fichier par blocs"""
+    crc = 0
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(COPY_CHUNK_SIZE)
+            if not chunk:
+                return crc
+            crc = zlib.crc32(chunk, crc)
+
+def file_content_hash(path):
+    """Empreinte BLAKE2b du contenu d'un fichier, lue par blocs"""
+    digest = hashlib.blake2b(digest_size=20)
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(COPY_CHUNK_SIZE)
+            if not chunk:
+                return digest.hexdigest()
+            digest.update(chunk)
+
+def cbz_content_hash(cbz_path):
+    """Empreinte du contenu d'un CBZ : noms, tailles et CRC des pages lus dans le répertoire
+    central de l'archive, sans décompresser les pages ni dépendre de leurs horodatages"""
+    try:
+        with zipfile.ZipFile(cbz_path) as archive:
+            entries = sorted((info.filename, info.file_size, info.CRC) for info in archive.infolist())
+    except zipfile.BadZipFile:
+        return file_content_hash(cbz_path)
+    
+    digest = hashlib.blake2b(digest_size=20)
+    for name, size, crc in entries:
+        digest.update(f"{name}\0{size}\0{crc}\n".encode())
+    return digest.hexdigest()
+
+def copy_and_remove(src, dest, replace):
+    """Copie un fichier par blocs avec fsync et vérification, puis supprime la source
+
+    Retourne le nombre d'octets copiés. La copie est écrite sous un nom temporaire et n'apparaît
+    sous son nom définitif qu'une fois vérifiée (taille et CRC32).
+    """
+    if not replace and os.path.lexists(dest):
+        raise FileExistsError(errno.EEXIST, os.strerror(errno.EEXIST), dest)
+    
+    temp_dest = f"{dest}{COPY_TEMP_SUFFIX}"
+    size = 0
+    crc = 0
+    try:
+        with open(src, 'rb') as fin, open(temp_dest, 'wb') as fout:
+            while True:
+                chunk = fin.read(COPY_CHUNK_SIZE)
+                if not chunk:
+                    break
+                fout.write(chunk)
+                crc = zlib.crc32(chunk, crc)
+                size += len(chunk)
+            fout.flush()
+            os.fsync(fout.fileno())
+        
+        try:
+            shutil.copystat(src, temp_dest)
+        except OSError:
+            pass
+        
+        if os.path.getsize(src) != size or os.path.getsize(temp_dest) != size or file_crc32(temp_dest) != crc:
+            raise OSError(errno.EIO, f"Copie invalide de {src} vers {dest}")
+        
+        os.replace(temp_dest, dest)
+    except BaseException:
+        if os.path.exists(temp_dest):
+            os.remove(temp_dest)
+        raise
+    
+    # Rendre le nouveau nom durable avant de supprimer la source
+    dir_fd = os.open(os.path.dirname(dest), os.O_RDONLY)
+    try:
+        os.fsync(dir_fd)
+    finally:
+        os.close(dir_fd)
+    
+    os.unlink(src)
+    move_stats.add('copied', size)
+    logging.info(f"Copie entre systèmes de fichiers: {src} -> {dest} ({size} octets)")
+    return size
+
+def move_file(src, dest, replace=True):
+    """Déplace un fichier sans copie quand c'est possible et retourne le nombre d'octets copiés
+
+    Sur un même périphérique, le fichier est renommé (ou lié puis délié si replace=False, ce qui
+    refuse d'écraser une destination existante) ; sinon il est copié par blocs puis vérifié.
+    Deux points de montage d'un même système de fichiers partagent st_dev mais refusent rename :
+    l'erreur EXDEV bascule alors aussi sur la copie.
+    """
+    os.makedirs(os.path.dirname(dest), exist_ok=True)
+    if plan_move(src, dest) == 'rename' and move_without_copy(src, dest, replace):
+        return 0
+    return copy_and_remove(src, dest, replace)
+
+def move_tree(src_dir, dest_dir):
+    """Déplace un dossier vers un chemin inexistant et retourne le nombre d'octets copiés"""
+    os.makedirs(os.path.dirname(dest_dir), exist_ok=True)
+    if plan_move(src_dir, dest_dir) == 'rename':
+        try:
+            os.rename(src_dir, dest_dir)
+            move_stats.add('renamed')
+            return 0
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                raise
+    
+    # Entre périphériques : fichier par fichier, puis suppression des dossiers vidés
+    copied_bytes = 0
+    for root, dirs, files in os.walk(src_dir):
+        target_root = os.path.normpath(os.path.join(dest_dir, os.path.relpath(root, src_dir)))
+        os.makedirs(target_root, exist_ok=True)
+        for file in files:
+            copied_bytes += move_file(os.path.join(root, file), os.path.join(target_root, file), replace=False)
+    for root, dirs, files in os.walk(src_dir, topdown=False):
+        os.rmdir(root)
+    return copied_bytes
+
+def run_capture(argv, timeout=PROBE_TIMEOUT):
+    """Exécute un outil d'inspection (pdfinfo, pdfimages -list...) et retourne sa sortie, ou None
+
+    L'outil est tué s'il dépasse `timeout` secondes : un PDF malformé ne peut pas bloquer le worker.
+    """
     try:
         result = subprocess.run(
-            command,
-            shell=True,
+            argv,
             check=True,
-            cwd=cwd,
+            stdin=subprocess.DEVNULL,
             stdout=subprocess.PIPE,
             stderr=subprocess.PIPE,
-            text=True
+            text=True,
+            errors='replace',
+            timeout=timeout
         )
-        if result.stdout:
-            logging.info(result.stdout)
-        return True
-    except subprocess.CalledProcessError as e:
-        logging.error(f"Erreur lors de l'exécution de la commande: {e}")
-        if e.stdout:
-            logging.info(e.stdout)
-        if e.stderr:
-            logging.error(e.stderr)
-        return False
+    except subprocess.TimeoutExpired:
+        logging.warning(f"Commande interrompue (délai de {timeout:.0f}s dépassé): {shlex.join(argv)}")
+        return None
+    except (OSError, subprocess.CalledProcessError) as e:
+        logging.warning(f"Échec de la commande {argv[0]}: {e}")
+        return None
+    return result.stdout
+
+def get_pdf_info(pdf_path):
+    """Retourne (nombre de pages, (largeur, hauteur) de la première page en points) via pdfinfo
+
+    Chaque valeur vaut None si elle n'a pas pu être lue.
+    """
+    output = run_capture(["pdfinfo", pdf_path])
+    if output is None:
+        logging.warning(f"Impossible de lire le nombre de pages de {pdf_path}")
+        return None, None
+    
+    page_count = None
+    page_size = None
+    for line in output.splitlines():
+        try:
+            if line.startswith("Pages:"):
+                page_count = int(line.split(":", 1)[1])
+            elif line.startswith("Page size:"):
+                width, _, height = line.split(":", 1)[1].split()[:3]
+                page_size = (float(width), float(height))
+        except ValueError:
+            continue
+    return page_count, page_size
+
+def profile_for(file_path):
+    """Retourne le profil d'encodage de la catégorie d'un fichier de to_convert"""
+    category = os.path.relpath(file_path, TO_CONVERT_DIR).split(os.sep)[0]
+    return ENCODING_PROFILES.get(category, FALLBACK_PROFILE)
+
+def rasterization_dpi(profile, page_size):
+    """Résolution de rasterisation : le plus grand côté de la page atteint max_edge, sans dépasser max_dpi"""
+    if not profile.max_edge or not page_size or max(page_size) <= 0:
+        return profile.max_dpi
+    return max(36, min(profile.max_dpi, int(profile.max_edge * 72 / max(page_size))))
+
+class QualityController:
+    """Ajuste la qualité JPEG au fil des plages de pages pour approcher la taille cible par page
+
+    La taille d'un JPEG varie à peu près linéairement avec la qualité dans la plage utile : un
+    écart à la cible déplace la qualité proportionnellement, par pas bornés.
+    """
+
+    def __init__(self, profile):
+        self.profile = profile
+        self.quality = profile.quality
+
+    def update(self, total_bytes, pages):
+        if not self.profile.target_kb or not pages:
+            return
+        ratio = total_bytes / pages / (self.profile.target_kb * 1024)
+        if abs(ratio - 1) <= TARGET_TOLERANCE:
+            return
+        step = max(-10, min(5, round((1 - ratio) * 10)))
+        quality = max(self.profile.min_quality, min(self.profile.max_quality, self.quality + step))
+        if quality != self.quality:
+            logging.info(f"Qualité JPEG ajustée de {self.quality} à {quality} ({ratio:.2f} x la cible)")
+            self.quality = quality
+
+def get_passthrough_pages(pdf_path, page_count, max_edge=0):
+    """Retourne les pages dont l'image d'origine peut être extraite telle quelle
+
+    Une page est éligible si elle ne contient qu'une seule image, dans un encodage lisible par
+    les liseuses, qui couvre toute la page dans le même sens. Un document contenant des polices
+    (texte, OCR) est entièrement rasterisé : le texte et les éléments vectoriels seraient perdus.
+    pdfimages -all extrait les échantillons bruts de l'image, sans la rotation de la page (/Rotate)
+    ni sa matrice de transformation : une page tournée, ou dont l'image est couchée, est rasterisée.
+    """
+    fonts = run_capture(["pdffonts", pdf_path])
+    if fonts is None or len(fonts.splitlines()) > 2:
+        return set()
+    
+    listing = run_capture(["pdfimages", "-list", pdf_path])
+    if listing is None:
+        return set()
+    
+    # Colonnes : page num type width height color comp bpc enc interp object ID x-ppi y-ppi size ratio
+    page_images = {}
+    for line in listing.splitlines()[2:]:
+        columns = line.split()
+        if len(columns) >= 14 and columns[0].isdigit():
+            page_images.setdefault(int(columns[0]), []).append(columns)
+    
+    candidates = {
+        page: images[0] for page, images in page_images.items()
+        if len(images) == 1
+        and images[0][2] == 'image'
+        and images[0][5] in PASSTHROUGH_COLORS
+        and images[0][8] in PASSTHROUGH_ENCODINGS
+    }
+    if not candidates:
+        return set()
+    
+    page_info = run_capture(["pdfinfo", "-f", "1", "-l", str(page_count), pdf_path]) or ""
+    page_sizes = {
+        int(page): (float(width), float(height))
+        for page, width, height in PAGE_SIZE_PATTERN.findall(page_info)
+    }
+    page_rotations = {int(page): int(rotation) % 360 for page, rotation in PAGE_ROTATION_PATTERN.findall(page_info)}
+    
+    eligible = set()
+    for page, columns in candidates.items():
+        try:
+            width, height = int(columns[3]), int(columns[4])
+            x_ppi, y_ppi = float(columns[12]), float(columns[13])
+        except ValueError:
+            continue
+        if page not in page_sizes or page_rotations.get(page) != 0 or x_ppi <= 0 or y_ppi <= 0:
+            continue
+        # Une image plus grande que le profil doit être réduite : rasterisation
+        if max_edge and max(width, height) > max_edge * (1 + TARGET_TOLERANCE):
+            continue
+        
+        # Dimensions affichées de l'image en points, comparées largeur à largeur et hauteur à hauteur
+        # à celles de la page : une image couchée sur la page (rotation de 90°) ne correspond pas
+        shown = (width / x_ppi * 72, height / y_ppi * 72)
+        if all(s >= p * PASSTHROUGH_MIN_COVERAGE for s, p in zip(shown, page_sizes[page])):
+            eligible.add(page)
+    
+    return eligible
 
-def pdf_to_cbz(pdf_path, output_dir):
-    """Convertit un PDF en CBZ en utilisant pdftoppm et ZIP"""
+def plan_page_ranges(page_count, passthrough_pages):
+    """Découpe les pages en plages (première, dernière, extraction directe) d'au plus PDF_CHUNK_PAGES pages"""
+    ranges = []
+    first = 1
+    while first <= page_count:
+        passthrough = first in passthrough_pages
+        last = first
+        while (last < page_count and last - first + 1 < PDF_CHUNK_PAGES
+               and ((last + 1) in passthrough_pages) == passthrough):
+            last += 1
+        ranges.append((first, last, passthrough))
+        first = last + 1
+    return ranges
+
+def render_page_range(pdf_path, temp_dir, first=None, last=None, passthrough=False, job=None,
+                      dpi=150, quality=None):
+    """Produit les images d'une plage de pages (tout le document par défaut) dans un sous-dossier dédié
+
+    En mode extraction directe, les images d'origine sont copiées par pdfimages sans décodage ;
+    sinon les pages sont rasterisées par pdftoppm en JPEG à `dpi` (qualité `quality`, ou celle
+    par défaut de pdftoppm). Retourne (succès, [(numéro de page, chemin)]).
+    """
+    chunk_dir = tempfile.mkdtemp(dir=temp_dir, prefix="pages-")
+    page_range = ["-f", str(first), "-l", str(last)] if first is not None else []
+    
+    if passthrough:
+        success = run_command(["pdfimages", "-all", "-p", *page_range, pdf_path, f"{chunk_dir}/page"], job=job)
+        images = list_page_images(chunk_dir, EXTRACTED_PAGE_PATTERN)
+        if success and len(images) == last - first + 1:
+            return True, images
+        
+        logging.warning(f"Extraction directe inattendue pour les pages {first}-{last}, rasterisation")
+        shutil.rmtree(chunk_dir, ignore_errors=True)
+        return render_page_range(pdf_path, temp_dir, first, last, job=job, dpi=dpi, quality=quality)
+    
+    jpeg_options = ["-jpegopt", f"quality={quality},optimize=y"] if quality else []
+    success = run_command(
+        ["pdftoppm", "-jpeg", *jpeg_options, "-r", str(dpi), *page_range, pdf_path, f"{chunk_dir}/page"],
+        job=job
+    )
+    return success, list_page_images(chunk_dir, PAGE_NUMBER_PATTERN)
+
+def list_page_images(chunk_dir, pattern):
+    """Liste les images d'un dossier triées par numéro de page
+
+    Tri numérique : l'ordre des pages ne dépend pas du remplissage de zéros choisi par l'outil.
+    """
+    images = []
+    for image_file in os.listdir(chunk_dir):
+        match = pattern.search(image_file)
+        if match:
+            images.append((int(match.group(1)), os.path.join(chunk_dir, image_file)))
+    return sorted(images)
+
+def iter_pdf_pages(pdf_path, temp_dir, page_count, job=None, profile=FALLBACK_PROFILE, page_size=None):
+    """Génère (numéro de page, chemin de l'image) dans l'ordre des pages, au fil de leur production
+
+    Le document est découpé en plages de PDF_CHUNK_PAGES pages traitées en parallèle dans une
+    fenêtre glissante : au plus PDF_PAGE_WORKERS + 1 plages existent sur disque en même temps.
+    La résolution est déduite du profil et de la taille des pages ; la qualité JPEG est ajustée
+    d'une plage à l'autre selon la taille obtenue par page.
+    L'appelant supprime chaque image une fois archivée. Lève RuntimeError en cas d'échec, après
+    avoir annulé `job` pour interrompre les plages encore en cours.
+    """
+    dpi = rasterization_dpi(profile, page_size)
+    controller = QualityController(profile)
+    
+    if not page_count:
+        # Nombre de pages inconnu : rasterisation du document en une fois
+        success, images = render_page_range(pdf_path, temp_dir, job=job, dpi=dpi, quality=controller.quality)
+        if not success:
+            raise RuntimeError("échec de pdftoppm")
+        yield from images
+        return
+    
+    passthrough_pages = get_passthrough_pages(pdf_path, page_count, profile.max_edge) if PDF_PASSTHROUGH else set()
+    if passthrough_pages:
+        logging.info(f"Extraction directe de {len(passthrough_pages)}/{page_count} pages: {os.path.basename(pdf_path)}")
+    
+    ranges = iter(plan_page_ranges(page_count, passthrough_pages))
+    
+    def submit(page_range):
+        return executor.submit(render_page_range, pdf_path, temp_dir, *page_range,
+                               job=job, dpi=dpi, quality=controller.quality)
+    
+    with ThreadPoolExecutor(max_workers=PDF_PAGE_WORKERS, thread_name_prefix="pdf-pages") as executor:
+        in_flight = deque((page_range, submit(page_range)) for page_range in itertools.islice(ranges, PDF_PAGE_WORKERS))
+        while in_flight:
+            page_range, future = in_flight.popleft()
+            success, images = future.result()
+            
+            # Les pages rasterisées renseignent la taille obtenue à la qualité courante
+            if success and not page_range[2]:
+                controller.update(sum(os.path.getsize(path) for _, path in images), len(images))
+            
+            # Lancer la plage suivante avant d'archiver celle-ci pour garder les workers occupés
+            next_range = next(ranges, None)
+            if next_range is not None:
+                in_flight.append((next_range, submit(next_range)))
+            
+            if not success:
+                if job is not None:
+                    job.cancel("échec de la rasterisation d'une plage de pages")
+                raise RuntimeError("échec de pdftoppm")
+            yield from images
+            
+            if images:
+                shutil.rmtree(os.path.dirname(images[0][1]), ignore_errors=True)
+
+def pdf_to_cbz(pdf_path, output_dir, job=None, profile=FALLBACK_PROFILE):
+    """Convertit un PDF en CBZ en utilisant pdfimages/pdftoppm et ZIP
+
+    Les pages scannées sont extraites telles quelles, les autres sont rasterisées. Les pages sont ajoutées au CBZ au fur et à mesure de leur rasterisation puis supprimées :
+    l'espace temporaire reste borné à quelques pages quelle que soit la taille du livre.
+    """
+    partial_cbz = None
     try:
         # Obtenir le nom de base du fichier (sans extension)
         pdf_name = os.path.basename(pdf_path)
         base_name = os.path.splitext(pdf_name)[0]
         output_cbz = os.path.join(output_dir, f"{base_name}.cbz")
+        partial_cbz = f"{output_cbz}.tmp"
         
         logging.info(f"Conversion du PDF: {pdf_name} en CBZ")
         
+        # Remplissage de zéros uniforme pour que l'ordre alphabétique des pages soit le bon
+        page_count, page_size = get_pdf_info(pdf_path)
+        width = len(str(page_count)) if page_count else 4
+        
         # Créer un répertoire temporaire pour les images extraites
         with tempfile.TemporaryDirectory() as temp_dir:
-            # Convertir le PDF en images avec pdftoppm (partie de poppler-utils)
-            # Traitement page par page avec une qualité réduite pour éviter les problèmes de mémoire
-            pdftoppm_cmd = f"pdftoppm -jpeg -r 150 '{pdf_path}' '{temp_dir}/page'"
-            if not run_command(pdftoppm_cmd):
+            # Convertir le PDF en images avec pdfimages/pdftoppm (poppler-utils), par petites
+            # plages de pages, et archiver chaque page dès qu'elle est produite. Les images sont
+            # déjà compressées : elles sont stockées telles quelles (ZIP_STORED)
+            extracted_pages = 0
+            try:
+                with zipfile.ZipFile(partial_cbz, 'w', compression=zipfile.ZIP_STORED) as zipf:
+                    for number, img_path in iter_pdf_pages(pdf_path, temp_dir, page_count, job, profile, page_size):
+                        extension = os.path.splitext(img_path)[1]
+                        zipf.write(img_path, arcname=f"page-{number:0{width}d}{extension}")
+                        os.remove(img_path)
+                        extracted_pages += 1
+            except RuntimeError:
                 logging.error(f"Échec de l'extraction des images du PDF: {pdf_name}")
                 return False
             
             # Vérifier que des images ont été extraites
-            image_files = sorted([f for f in os.listdir(temp_dir) if f.endswith(('.jpg', '.jpeg'))])
-            if not image_files:
+            if not extracted_pages:
                 logging.error(f"Aucune image extraite du PDF: {pdf_name}")
                 return False
             
-            logging.info(f"Nombre de pages extraites du PDF: {len(image_files)}")
+            logging.info(f"Nombre de pages extraites du PDF: {extracted_pages}")
             
-            # Créer un fichier CBZ (ZIP) contenant les images
-            with zipfile.ZipFile(output_cbz, 'w') as zipf:
-                for img_file in image_files:
-                    img_path = os.path.join(temp_dir, img_file)
-                    zipf.write(img_path, arcname=img_file)
-            
-            # Vérifier que le CBZ a été créé
-            if not os.path.exists(output_cbz):
-                logging.error(f"Échec de la création du CBZ: {output_cbz}")
-                return False
+            # Le CBZ n'apparaît sous son nom définitif qu'une fois complet
+            os.replace(partial_cbz, output_cbz)
             
             logging.info(f"Conversion réussie: {pdf_name} -> {output_cbz}")
             return True
     
     except Exception as e:
-        logging.error(f"Erreur lors de la conversion du PDF {pdf_path}: {e}")
-        return False
-
-def convert_non_pdf_files(file_path, output_dir):
-    """Convertit un fichier non-PDF avec cbconvert"""
-    file_name = os.path.basename(file_path)
-    logging.info(f"Conversion du fichier non-PDF: {file_name}")
-    
-    cmd = f"cbconvert convert --no-nonimage --outdir '{output_dir}' --quality 85 '{file_path}'"
-    success = run_command(cmd)
-    
-    # Vérifier si la conversion a réussi en cherchant le fichier de sortie
-    base_name = os.path.splitext(os.path.basename(file_path))[0]
-    expected_output = os.path.join(output_dir, f"{base_name}.cbz")
+        logging.error(f"Erreur lors de la conversion du PDF {pdf_path}: {e}")
+        return False
+    finally:
+        if partial_cbz and os.path.exists(partial_cbz):
+            os.remove(partial_cbz)
+
+def cbconvert_command(file_path, output_dir, profile, quality):
+    """Construit la commande cbconvert appliquant un profil d'encodage"""
+    cmd = ["cbconvert", "convert", "--no-nonimage", "--outdir", output_dir,
+           "--format", profile.format, "--quality", str(quality or CBCONVERT_DEFAULT_QUALITY)]
+    if profile.max_edge:
+        # Ajuste l'image dans un carré max_edge x max_edge sans jamais l'agrandir
+        cmd += ["--width", str(profile.max_edge), "--height", str(profile.max_edge), "--fit"]
+    return cmd + [file_path]
+
+def average_page_size(cbz_path):
+    """Taille moyenne en octets des pages d'un CBZ, ou None si elle ne peut être lue"""
+    try:
+        with zipfile.ZipFile(cbz_path) as archive:
+            sizes = [info.file_size for info in archive.infolist() if not info.is_dir()]
+    except (OSError, zipfile.BadZipFile):
+        return None
+    return sum(sizes) / len(sizes) if sizes else None
+
+def convert_non_pdf_files(file_path, output_dir, job=None, profile=FALLBACK_PROFILE):
+    """Convertit un fichier non-PDF avec cbconvert
+
+    Si les pages obtenues dépassent nettement la taille cible du profil, la conversion est
+    relancée une fois avec une qualité réduite en proportion.
+    """
+    file_name = os.path.basename(file_path)
+    logging.info(f"Conversion du fichier non-PDF: {file_name}")
+    
+    # Vérifier si la conversion a réussi en cherchant le fichier de sortie
+    base_name = os.path.splitext(os.path.basename(file_path))[0]
+    expected_output = os.path.join(output_dir, f"{base_name}.cbz")
+    
+    quality = profile.quality
+    while True:
+        success = run_command(cbconvert_command(file_path, output_dir, profile, quality), job=job)
+        
+        # Une commande tuée (délai dépassé, annulation) peut laisser un CBZ incomplet
+        if not success and os.path.exists(expected_output):
+            os.remove(expected_output)
+        
+        if not success or not profile.target_kb or quality != profile.quality:
+            break
+        page_size = average_page_size(expected_output)
+        if page_size is None or page_size <= profile.target_kb * 1024 * (1 + TARGET_TOLERANCE):
+            break
+        
+        ratio = page_size / (profile.target_kb * 1024)
+        quality = max(profile.min_quality, int(profile.quality / ratio))
+        if quality >= profile.quality:
+            break
+        logging.info(f"Pages de {page_size / 1024:.0f} Ko pour une cible de {profile.target_kb} Ko, "
+                     f"nouvelle conversion en qualité {quality}: {file_name}")
+        os.remove(expected_output)
+    
+    if not os.path.exists(expected_output):
+        logging.error(f"La conversion a échoué, aucun fichier de sortie trouvé pour: {file_name}")
+        return False
+    
+    logging.info(f"Conversion réussie: {file_name} -> {expected_output}")
+    return True
+
+def conversion_output_path(file_path):
+    """Retourne le chemin du CBZ produit dans cbz_convert pour un fichier de to_convert"""
+    rel_path = os.path.relpath(file_path, TO_CONVERT_DIR)
+    base_name = os.path.splitext(os.path.basename(rel_path))[0]
+    return os.path.join(CBZ_CONVERT_DIR, os.path.dirname(rel_path), f"{base_name}.cbz")
+
+def convert_file(file_path, job=None):
+    """Convertit un fichier de to_convert en CBZ dans cbz_convert et retourne True en cas de succès"""
+    # Déterminer le répertoire de sortie
+    output_dir = os.path.dirname(conversion_output_path(file_path))
+    
+    # Créer le dossier de sortie si nécessaire
+    os.makedirs(output_dir, exist_ok=True)
+    
+    profile = profile_for(file_path)
+    
+    # Convertir le fichier en fonction de son type
+    if file_path.lower().endswith('.pdf'):
+        # Utiliser notre fonction personnalisée pour convertir les PDF
+        logging.info(f"Utilisation de la méthode personnalisée pour le PDF: {file_path}")
+        return pdf_to_cbz(file_path, output_dir, job, profile)
+    
+    # Utiliser cbconvert pour les autres formats
+    return convert_non_pdf_files(file_path, output_dir, job, profile)
+
+def conversion_settings(file_path):
+    """Réglages de conversion d'un fichier, inclus dans la clé du cache de conversion"""
+    profile = profile_for(file_path)
+    if file_path.lower().endswith('.pdf'):
+        return f"pdftoppm -jpeg; passthrough={int(PDF_PASSTHROUGH)}; {profile.key()}"
+    return f"cbconvert --no-nonimage; {profile.key()}"
+
+def register_output(file_path, source_hash, settings):
+    """Enregistre le CBZ produit pour un fichier, ou le supprime s'il existe déjà à l'identique
+
+    Un CBZ identique déjà présent dans la bibliothèque, ou en attente d'import dans cbz_convert,
+    rend le nouveau CBZ inutile : il est supprimé avant d'atteindre la bibliothèque.
+    """
+    output_path = conversion_output_path(file_path)
+    try:
+        output_hash = cbz_content_hash(output_path)
+    except OSError as e:
+        logging.warning(f"Impossible de calculer l'empreinte de {output_path}: {e}")
+        return
+    
+    for existing_output, library_path in job_store.find_output(output_hash):
+        if library_path and os.path.isfile(library_path):
+            existing = library_path
+        elif existing_output != output_path and os.path.isfile(existing_output):
+            existing = existing_output
+        else:
+            continue
+        
+        os.remove(output_path)
+        cache_stats.add('duplicates')
+        logging.info(f"CBZ identique déjà présent ({existing}), doublon supprimé: {output_path}")
+        job_store.record_conversion(source_hash, settings, output_hash, existing_output, library_path)
+        return
+    
+    job_store.record_conversion(source_hash, settings, output_hash, output_path)
+
+def record_conversion_metrics(file_path, method, bytes_in, duration):
+    """Enregistre la durée, le nombre de pages et les volumes d'une conversion réussie"""
+    output_path = conversion_output_path(file_path)
+    try:
+        bytes_out = os.path.getsize(output_path)
+        with zipfile.ZipFile(output_path) as archive:
+            pages = len(archive.infolist())
+    except OSError:
+        bytes_out = pages = 0
+    except zipfile.BadZipFile:
+        pages = 0
+    
+    metrics.observe("kavita_conversion_duration_seconds", duration, method=method)
+    metrics.inc("kavita_conversion_pages_total", pages, method=method)
+    metrics.inc("kavita_conversion_bytes_in_total", bytes_in, method=method)
+    metrics.inc("kavita_conversion_bytes_out_total", bytes_out, method=method)
+    if duration > 0:
+        metrics.set("kavita_conversion_pages_per_second", round(pages / duration, 3), method=method)
+
+def convert_job(file_path):
+    """Convertit un fichier de to_convert en suivant son état dans JobStore et retourne True en cas de succès
+
+    Un fichier dont le contenu a déjà été converti avec les mêmes réglages, et dont le CBZ est
+    toujours dans la bibliothèque, n'est pas reconverti : il est simplement nettoyé à l'import.
+    """
+    if not os.path.isfile(file_path):
+        logging.warning(f"Fichier à convertir introuvable, abandon: {file_path}")
+        job_store.delete([file_path])
+        return False
+    
+    job_store.set_state([file_path], JobStore.CONVERTING)
+    
+    settings = conversion_settings(file_path)
+    try:
+        source_hash = file_content_hash(file_path)
+    except OSError as e:
+        logging.warning(f"Impossible de calculer l'empreinte de {file_path}: {e}")
+        source_hash = None
+    
+    if source_hash is not None:
+        library_path = job_store.lookup_conversion(source_hash, settings)
+        if library_path is not None and os.path.isfile(library_path):
+            cache_stats.add('hits')
+            logging.info(f"Contenu déjà importé ({library_path}), conversion ignorée: {file_path}")
+            job_store.set_state([file_path], JobStore.CONVERTED)
+            return True
+        cache_stats.add('misses')
+    
+    method = 'pdf_to_cbz' if file_path.lower().endswith('.pdf') else 'cbconvert'
+    bytes_in = os.path.getsize(file_path)
+    job = JobContext(file_path, JOB_TIMEOUT)
+    with running_jobs_lock:
+        running_jobs.add(job)
+    try:
+        success = convert_file(file_path, job)
+    except Exception as e:
+        logging.error(f"Erreur inattendue lors de la conversion de {file_path}: {e}")
+        success = False
+    finally:
+        with running_jobs_lock:
+            running_jobs.discard(job)
+    logging.info(f"Ressources de la conversion de {os.path.basename(file_path)}: {job.summary()}")
     
-    if not os.path.exists(expected_output):
-        logging.error(f"La conversion a échoué, aucun fichier de sortie trouvé pour: {file_name}")
+    if shutting_down.is_set():
+        # Conversion interrompue par l'arrêt : laissée en converting, reprise au redémarrage
         return False
     
-    logging.info(f"Conversion réussie: {file_name} -> {expected_output}")
-    return True
+    metrics.inc("kavita_conversion_cpu_seconds_total", job.cpu_time, method=method)
+    if success:
+        record_conversion_metrics(file_path, method, bytes_in, time.monotonic() - job.started)
+        if source_hash is not None:
+            register_output(file_path, source_hash, settings)
+        job_store.set_state([file_path], JobStore.CONVERTED)
+        return True
+    
+    logging.error(f"Échec de la conversion du fichier: {file_path}")
+    metrics.inc("kavita_conversion_failures_total", method=method)
+    if job_store.mark_failed(file_path, "échec de la conversion"):
+        logging.info(f"Nouvelle tentative programmée pour: {file_path}")
+    else:
+        logging.error(f"Abandon après {MAX_ATTEMPTS} tentatives: {file_path}")
+    return False
 
 def convert_files():
-    """Convertit les fichiers en CBZ"""
-    global files_to_process
-    
+    """Convertit en une fois tous les fichiers en attente dans convert_queue (hors pipeline)"""
     logging.info("Début de la conversion des fichiers...")
     
-    # Copier la liste des fichiers à traiter pour ce cycle
-    with processing_lock:
-        current_files = files_to_process.copy()
-        logging.info(f"Traitement de {len(current_files)} fichiers dans ce cycle")
+    # Retirer de la file les fichiers à traiter pour ce cycle
+    all_files = []
+    while True:
+        try:
+            all_files.append(convert_queue.get_nowait())
+        except queue.Empty:
+            break
+    logging.info(f"Traitement de {len(all_files)} fichiers dans ce cycle")
     
     # Si aucun fichier à traiter
-    if not current_files:
+    if not all_files:
         return True
     
-    # Collecter tous les fichiers à traiter
-    all_files = []
-    for file_path in current_files:
-        if os.path.exists(file_path) and os.path.isfile(file_path):
-            all_files.append(file_path)
-    
-    # Structure pour suivre la progression
-    file_stats = {
-        'total': len(all_files),
-        'success': 0,
-        'failed': 0
-    }
-    
-    # Convertir chaque fichier individuellement
-    converted_files = []
-    
-    for file_path in all_files:
-        # Déterminer le répertoire de sortie
-        rel_path = os.path.relpath(file_path, TO_CONVERT_DIR)
-        output_dir = os.path.join(CBZ_CONVERT_DIR, os.path.dirname(rel_path))
-        
-        # Créer le dossier de sortie si nécessaire
-        os.makedirs(output_dir, exist_ok=True)
-        
-        # Convertir le fichier en fonction de son type
-        success = False
-        if file_path.lower().endswith('.pdf'):
-            # Utiliser notre fonction personnalisée pour convertir les PDF
-            logging.info(f"Utilisation de la méthode personnalisée pour le PDF: {file_path}")
-            success = pdf_to_cbz(file_path, output_dir)
-        else:
-            # Utiliser cbconvert pour les autres formats
-            success = convert_non_pdf_files(file_path, output_dir)
-        
-        if success:
-            converted_files.append(file_path)
-            file_stats['success'] += 1
-        else:
-            file_stats['failed'] += 1
-            logging.error(f"Échec de la conversion du fichier: {file_path}")
-    
-    # Mettre à jour la liste des fichiers à traiter (retirer ceux qui ont été convertis)
-    with processing_lock:
-        for file_path in converted_files:
-            if file_path in files_to_process:
-                files_to_process.remove(file_path)
+    # Convertir les fichiers en parallèle : chaque worker pilote son propre processus de conversion
+    workers = min(CONVERSION_WORKERS, len(all_files))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="conversion") as executor:
+        results = list(executor.map(convert_job, all_files))
     
     # Rapport de conversion
-    logging.info(f"Conversion terminée: {file_stats['success']}/{file_stats['total']} fichiers convertis avec succès")
+    logging.info(f"Conversion terminée: {sum(results)}/{len(all_files)} fichiers convertis avec succès")
     
     # Si tous les fichiers ont été convertis avec succès, retourner True
-    return file_stats['failed'] == 0
+    return all(results)
 
 def clean_processed_files(processed_files):
     """Supprime uniquement les fichiers qui ont été traités avec succès"""
@@ -233,6 +2018,220 @@ def clean_to_convert_directory():
         logging.error(f"Erreur lors du nettoyage du répertoire: {e}")
         return False
 
+def natural_sort_key(name):
+    """Clé de tri naturel : v2 avant v10"""
+    return [int(part) if part.isdigit() else part.lower() for part in re.split(r'(\d+)', name)]
+
+def strip_series_name(stem, series_name):
+    """Retire le nom de la série en tête d'un nom de fichier, quels que soient casse et séparateurs
+
+    Les chiffres du nom de la série ("Mob Psycho 100") ne sont pas un numéro de volume.
+    """
+    words = re.findall(r'[^\W_]+', series_name)
+    if not words:
+        return stem
+    prefix = re.match(r'[\W_]*' + r'[\W_]+'.join(map(re.escape, words)) + r'(?![^\W_])', stem, re.IGNORECASE)
+    return stem[prefix.end():] if prefix else stem
+
+def parse_volume_number(file_name, series_name=None):
+    """Retourne le numéro de volume indiqué dans un nom de fichier, ou None"""
+    stem = os.path.splitext(file_name)[0]
+    if series_name:
+        stem = strip_series_name(stem, series_name)
+    match = VOLUME_NUMBER_PATTERN.search(stem)
+    return int(match.group(1) or match.group(2)) if match else None
+
+class SeriesVolumeIndex:
+    """Cache des volumes présents dans chaque dossier de série de la bibliothèque
+
+    Un dossier n'est relisté que si son mtime a changé depuis la dernière lecture : les imports
+    successifs d'une même série ne coûtent qu'un stat.
+    """
+
+    def __init__(self):
+        self._series = {}  # dossier de série -> (st_mtime_ns, numéros de volume, noms de fichiers)
+
+    def get(self, series_path):
+        """Retourne (numéros de volume utilisés, noms de fichiers présents) d'un dossier de série"""
+        try:
+            mtime_ns = os.stat(series_path).st_mtime_ns
+        except FileNotFoundError:
+            return set(), set()
+        
+        cached = self._series.get(series_path)
+        if cached is not None and cached[0] == mtime_ns:
+            return cached[1], cached[2]
+        
+        names = set(os.listdir(series_path))
+        series_name = os.path.basename(series_path)
+        numbers = {parse_volume_number(name, series_name) for name in names} - {None}
+        self._series[series_path] = (mtime_ns, numbers, names)
+        return numbers, names
+
+    def record(self, series_path, new_names):
+        """Ajoute au cache les fichiers que l'on vient de déplacer dans un dossier de série"""
+        cached = self._series.get(series_path)
+        if cached is None:
+            # Lecture complète, qui inclut déjà les nouveaux fichiers
+            self.get(series_path)
+            return
+        
+        names = cached[2] | set(new_names)
+        series_name = os.path.basename(series_path)
+        numbers = cached[1] | ({parse_volume_number(name, series_name) for name in new_names} - {None})
+        try:
+            self._series[series_path] = (os.stat(series_path).st_mtime_ns, numbers, names)
+        except FileNotFoundError:
+            self._series.pop(series_path, None)
+
+volume_index = SeriesVolumeIndex()
+
+def plan_volume_renames(file_names, series_name, used_numbers, used_names):
+    """Calcule en une passe les nouveaux noms "<série> vNN.ext" des volumes d'une série
+
+    Un numéro de volume lu dans le nom du fichier est toujours conservé : s'il est déjà présent
+    dans la bibliothèque (ou porté par un autre fichier du lot), le fichier est un doublon et n'est
+    pas renommé (move_series_folder le met en quarantaine). Les fichiers sans numéro sont numérotés à la suite du plus grand numéro déjà
+    présent, dans l'ordre naturel des noms.
+    Retourne (couples (ancien nom, nouveau nom), doublons).
+    """
+    ordered = sorted(file_names, key=natural_sort_key)
+    taken = set(used_numbers)
+    numbers = {}
+    duplicates = []
+    
+    # Un fichier qui porte déjà son nom final garde son numéro : un doublon ne doit jamais
+    # occuper le nom vers lequel un autre fichier du lot serait renommé
+    def already_named(name):
+        number = parse_volume_number(name, series_name)
+        return number is not None and name == f"{series_name} v{number:02d}{os.path.splitext(name)[1]}"
+    
+    for name in sorted(ordered, key=lambda name: not already_named(name)):
+        number = parse_volume_number(name, series_name)
+        if number is None:
+            continue
+        if number in taken:
+            logging.warning(f"Volume v{number:02d} déjà présent pour {series_name}, doublon: {name}")
+            duplicates.append(name)
+        else:
+            numbers[name] = number
+            taken.add(number)
+    
+    next_number = max(taken, default=0) + 1
+    plan = []
+    for name in ordered:
+        if name in duplicates:
+            continue
+        if name not in numbers:
+            numbers[name] = next_number
+            taken.add(next_number)
+            next_number += 1
+        
+        extension = os.path.splitext(name)[1]
+        new_name = f"{series_name} v{numbers[name]:02d}{extension}"
+        while new_name in used_names:
+            # Nom déjà pris dans la bibliothèque par un fichier sans numéro reconnu
+            numbers[name] = next_number
+            taken.add(next_number)
+            next_number += 1
+            new_name = f"{series_name} v{numbers[name]:02d}{extension}"
+        plan.append((name, new_name))
+    
+    return plan, duplicates
+
+def apply_volume_renames(folder, plan):
+    """Applique un plan de renommage avec des os.rename atomiques
+
+    Les fichiers dont le nouveau nom est occupé par un autre fichier du plan passent par un nom
+    temporaire, pour que les permutations (v02 <-> v01) ne s'écrasent pas.
+    """
+    sources = {old for old, new in plan}
+    deferred = []
+    for index, (old, new) in enumerate(plan):
+        if old == new:
+            continue
+        if new in sources:
+            temp_name = f".renaming-{index}{os.path.splitext(new)[1]}"
+            os.rename(os.path.join(folder, old), os.path.join(folder, temp_name))
+            deferred.append((temp_name, new))
+        else:
+            os.rename(os.path.join(folder, old), os.path.join(folder, new))
+    
+    for temp_name, new in deferred:
+        os.rename(os.path.join(folder, temp_name), os.path.join(folder, new))
+
+def quarantine_duplicates(item_path, duplicates):
+    """Déplace les volumes en double d'un dossier de série vers DUPLICATES_DIR/<catégorie>/<série>
+
+    Rien n'est écrasé : un nom déjà pris en quarantaine reçoit un suffixe " (2)", " (3)"...
+    Retourne le nombre d'octets copiés.
+    """
+    category = os.path.basename(os.path.dirname(item_path))
+    quarantine_path = os.path.join(DUPLICATES_DIR, category, os.path.basename(item_path))
+    copied_bytes = 0
+    for name in duplicates:
+        base, extension = os.path.splitext(name)
+        dest = os.path.join(quarantine_path, name)
+        suffix = 2
+        while os.path.lexists(dest):
+            dest = os.path.join(quarantine_path, f"{base} ({suffix}){extension}")
+            suffix += 1
+        copied_bytes += move_file(os.path.join(item_path, name), dest, replace=False)
+        metrics.inc("kavita_duplicate_volumes_total")
+        logging.warning(f"Doublon mis en quarantaine: {dest}")
+    return copied_bytes
+
+def move_series_folder(item_path, dest_dir):
+    """Renomme les volumes d'un dossier de série de cbz_convert et le déplace dans la bibliothèque
+
+    Les volumes dont le numéro est déjà présent dans la bibliothèque sont mis en quarantaine
+    dans DUPLICATES_DIR : aucun fichier ne reste dans cbz_convert après un import réussi.
+    """
+    item = os.path.basename(item_path)
+    dest_path = os.path.join(dest_dir, item)
+    
+    # Renommer les volumes en tenant compte de ceux déjà présents dans la bibliothèque
+    try:
+        used_numbers, used_names = volume_index.get(dest_path)
+        file_names = [
+            name for name in os.listdir(item_path)
+            if not name.startswith('.') and os.path.isfile(os.path.join(item_path, name))
+        ]
+        plan, duplicates = plan_volume_renames(file_names, item, used_numbers, used_names)
+        apply_volume_renames(item_path, plan)
+    except OSError as e:
+        logging.error(f"Échec du renommage dans {item_path}: {e}")
+        return False
+    
+    # Déplacer le dossier vers la destination
+    try:
+        copied_bytes = quarantine_duplicates(item_path, duplicates)
+        # Si le dossier de destination existe déjà, fusionner sans écraser de volume existant
+        if os.path.exists(dest_path):
+            for file in os.listdir(item_path):
+                file_src = os.path.join(item_path, file)
+                file_dest = os.path.join(dest_path, file)
+                if os.path.isdir(file_src) and not os.path.exists(file_dest):
+                    copied_bytes += move_tree(file_src, file_dest)
+                elif os.path.isdir(file_src):
+                    logging.warning(f"Sous-dossier déjà présent dans la bibliothèque, ignoré: {file_src}")
+                else:
+                    copied_bytes += move_file(file_src, file_dest, replace=False)
+            if not os.listdir(item_path):
+                os.rmdir(item_path)
+        else:
+            # Sinon, déplacer le dossier entier
+            copied_bytes += move_tree(item_path, dest_path)
+        volume_index.record(dest_path, [new for old, new in plan])
+        job_store.record_library_paths(
+            [(os.path.join(item_path, old), os.path.join(dest_path, new)) for old, new in plan]
+        )
+        logging.info(f"Déplacé: {item} vers {dest_dir} ({len(plan)} volumes, {copied_bytes} octets copiés)")
+        return True
+    except Exception as e:
+        logging.error(f"Erreur lors du déplacement de {item}: {e}")
+        return False
+
 def rename_and_move(source_dir, dest_dir, category):
     """Renomme et déplace les fichiers d'une catégorie spécifique"""
     logging.info(f"Traitement de la catégorie: {category}")
@@ -247,73 +2246,274 @@ def rename_and_move(source_dir, dest_dir, category):
         os.makedirs(dest_dir, exist_ok=True)
         logging.info(f"Répertoire de destination créé: {dest_dir}")
     
-    # Renommer les fichiers dans chaque sous-dossier
-    for item in os.listdir(source_dir):
-        item_path = os.path.join(source_dir, item)
-        if os.path.isdir(item_path):
-            # Utiliser f2 pour renommer les fichiers
-            cmd = 'f2 -r "{{p}} v{%02d}" -e -x'
-            if not run_command(cmd, cwd=item_path):
-                logging.error(f"Échec du renommage dans: {item_path}")
-    
-    # Déplacer les dossiers vers la destination
+    # Renommer et déplacer chaque sous-dossier
     for item in os.listdir(source_dir):
         item_path = os.path.join(source_dir, item)
         if os.path.isdir(item_path):
-            dest_path = os.path.join(dest_dir, item)
-            try:
-                # Si le dossier de destination existe déjà, fusionner
-                if os.path.exists(dest_path):
-                    for file in os.listdir(item_path):
-                        file_src = os.path.join(item_path, file)
-                        file_dest = os.path.join(dest_path, file)
-                        shutil.move(file_src, file_dest)
-                    os.rmdir(item_path)
-                else:
-                    # Sinon, déplacer le dossier entier
-                    shutil.move(item_path, dest_dir)
-                logging.info(f"Déplacé: {item} vers {dest_dir}")
-            except Exception as e:
-                logging.error(f"Erreur lors du déplacement de {item}: {e}")
+            move_series_folder(item_path, dest_dir)
     
     return True
 
-def process_convert_directory():
-    """Traite les fichiers dans le répertoire to_convert"""
-    global conversion_in_progress, files_to_process
+# Catégorie (premier niveau de to_convert et cbz_convert) -> (dossier source, destination, libellé)
+CATEGORIES = {
+    os.path.basename(MANGA_SRC): (MANGA_SRC, MANGA_DEST, "Manga"),
+    os.path.basename(COMICS_SRC): (COMICS_SRC, COMICS_DEST, "Comics"),
+    os.path.basename(BD_SRC): (BD_SRC, BD_DEST, "BD"),
+}
+
+def set_base_path(base_path):
+    """Reconfigure tous les chemins dérivés de BASE_PATH (benchmark, environnement de test)"""
+    global BASE_PATH, DOWNLOAD_DIR, TO_CONVERT_DIR, CBZ_CONVERT_DIR, DUPLICATES_DIR
+    global MANGA_DEST, COMICS_DEST, BD_DEST, MANGA_SRC, COMICS_SRC, BD_SRC, CATEGORIES
     
-    with processing_lock:
-        if conversion_in_progress:
+    BASE_PATH = base_path
+    DOWNLOAD_DIR = f"{BASE_PATH}/download"
+    TO_CONVERT_DIR = f"{BASE_PATH}/to_convert"
+    CBZ_CONVERT_DIR = f"{BASE_PATH}/cbz_convert"
+    DUPLICATES_DIR = f"{BASE_PATH}/duplicates"
+    MANGA_DEST = f"{BASE_PATH}/scans/Mangas"
+    COMICS_DEST = f"{BASE_PATH}/scans/Comics"
+    BD_DEST = f"{BASE_PATH}/scans/BD"
+    MANGA_SRC = f"{CBZ_CONVERT_DIR}/manga"
+    COMICS_SRC = f"{CBZ_CONVERT_DIR}/comics"
+    BD_SRC = f"{CBZ_CONVERT_DIR}/bd"
+    CATEGORIES = {
+        os.path.basename(MANGA_SRC): (MANGA_SRC, MANGA_DEST, "Manga"),
+        os.path.basename(COMICS_SRC): (COMICS_SRC, COMICS_DEST, "Comics"),
+        os.path.basename(BD_SRC): (BD_SRC, BD_DEST, "BD"),
+    }
+
+# API Kavita : scan ciblé des dossiers de série après import (désactivé sans clé d'API)
+KAVITA_URL = os.environ.get("KAVITA_URL", "http://kavita:5000")
+KAVITA_API_KEY = os.environ.get("KAVITA_API_KEY", "")
+# Chemin de BASE_PATH vu depuis le conteneur Kavita
+KAVITA_LIBRARY_ROOT = os.environ.get("KAVITA_LIBRARY_ROOT", "/books")
+# Délai sans nouvel import (en secondes) avant de demander le scan d'un dossier
+SCAN_DEBOUNCE = float(os.environ.get("KAVITA_SCAN_DEBOUNCE", 10))
+# Nouvelles tentatives d'un scan en échec : délai doublé à chaque échec (en secondes)
+SCAN_RETRY_DELAY = 30
+SCAN_MAX_ATTEMPTS = 5
+SCAN_REQUEST_TIMEOUT = 10
+
+def kavita_library_path(path):
+    """Traduit un chemin de ce conteneur en chemin vu par Kavita (BASE_PATH -> KAVITA_LIBRARY_ROOT)"""
+    rel_path = os.path.relpath(path, BASE_PATH)
+    if rel_path == os.curdir:
+        return KAVITA_LIBRARY_ROOT
+    return f"{KAVITA_LIBRARY_ROOT.rstrip('/')}/{rel_path}"
+
+class LibraryScanner:
+    """Demande à Kavita de scanner les dossiers de série importés (POST /api/Library/scan-folder)
+
+    Les dossiers sont regroupés : un dossier n'est envoyé qu'après SCAN_DEBOUNCE secondes sans
+    nouvel import, pour qu'une série importée en plusieurs fois ne déclenche qu'un scan. Un scan en
+    échec est retenté avec un délai doublé, au plus SCAN_MAX_ATTEMPTS fois.
+    """
+
+    def __init__(self, url, api_key, debounce=SCAN_DEBOUNCE, retry_delay=SCAN_RETRY_DELAY):
+        self.url = url.rstrip('/')
+        self.api_key = api_key
+        self.debounce = debounce
+        self.retry_delay = retry_delay
+        self._cond = threading.Condition()
+        self._pending = {}  # dossier -> (échéance, échecs)
+        self._thread = None
+
+    @property
+    def enabled(self):
+        return bool(self.url and self.api_key)
+
+    def notify(self, folder):
+        """Signale un dossier de la bibliothèque à faire scanner par Kavita"""
+        if not self.enabled:
+            return
+        with self._cond:
+            failures = self._pending.get(folder, (0, 0))[1]
+            self._pending[folder] = (time.monotonic() + self.debounce, failures)
+            self._cond.notify()
+
+    def pending_count(self):
+        with self._cond:
+            return len(self._pending)
+
+    def _schedule_retry(self, folder, failures):
+        with self._cond:
+            # Un nouvel import pendant le scan a déjà reprogrammé le dossier
+            if folder not in self._pending:
+                delay = self.retry_delay * 2 ** (failures - 1)
+                self._pending[folder] = (time.monotonic() + delay, failures)
+
+    def _take_due(self):
+        """Attend et retire les dossiers dont l'échéance est atteinte"""
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                due = {folder: failures for folder, (deadline, failures) in self._pending.items() if deadline <= now}
+                if due:
+                    for folder in due:
+                        del self._pending[folder]
+                    return due
+                next_deadline = min((deadline for deadline, _ in self._pending.values()), default=None)
+                self._cond.wait(None if next_deadline is None else next_deadline - now)
+
+    def scan_folder(self, folder):
+        """Envoie la demande de scan d'un dossier et retourne True si Kavita l'a acceptée"""
+        body = json.dumps({'apiKey': self.api_key, 'folderPath': kavita_library_path(folder)}).encode()
+        request = urllib.request.Request(
+            f"{self.url}/api/Library/scan-folder",
+            data=body,
+            headers={'Content-Type': 'application/json'},
+            method='POST'
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=SCAN_REQUEST_TIMEOUT) as response:
+                response.read()
+        except urllib.error.HTTPError as e:
+            logging.warning(f"Scan Kavita refusé pour {folder}: HTTP {e.code}")
+            metrics.inc("kavita_library_scans_total", result="failure")
+            return False
+        except (urllib.error.URLError, OSError) as e:
+            logging.warning(f"Kavita injoignable pour le scan de {folder}: {e}")
+            metrics.inc("kavita_library_scans_total", result="failure")
+            return False
+        logging.info(f"Scan Kavita demandé: {kavita_library_path(folder)}")
+        metrics.inc("kavita_library_scans_total", result="success")
+        return True
+
+    def run(self):
+        while True:
+            for folder, failures in sorted(self._take_due().items()):
+                if self.scan_folder(folder):
+                    continue
+                failures += 1
+                if failures < SCAN_MAX_ATTEMPTS:
+                    self._schedule_retry(folder, failures)
+                else:
+                    logging.error(f"Abandon du scan Kavita après {failures} tentatives: {folder}")
+
+    def start(self):
+        """Démarre le thread d'envoi des scans"""
+        if not self.enabled:
+            logging.info("KAVITA_API_KEY non défini : pas de scan ciblé, Kavita détectera les imports à son prochain scan")
+            return
+        if self._thread is None:
+            self._thread = threading.Thread(target=self.run, name="kavita-scan", daemon=True)
+            self._thread.start()
+            logging.info(f"Scan ciblé Kavita actif: {self.url} (regroupement sur {self.debounce:.0f}s)")
+
+library_scanner = LibraryScanner(KAVITA_URL, KAVITA_API_KEY)
+
+def series_folder(file_path):
+    """Retourne le dossier de série (to_convert/<catégorie>/<série>) d'un fichier de to_convert, ou None"""
+    parts = os.path.relpath(file_path, TO_CONVERT_DIR).split(os.sep)
+    if len(parts) < 3 or parts[0] not in CATEGORIES:
+        return None
+    return os.path.join(TO_CONVERT_DIR, parts[0], parts[1])
+
+def import_series(folder):
+    """Importe une série dans la bibliothèque une fois tous ses fichiers convertis
+
+    Les volumes d'une même série sont renommés ensemble : tant qu'un fichier du dossier est en
+    attente, en conversion ou doit être retenté, l'import de la série est différé. La série est
+    inscrite dans importing_series pendant l'import, qui peut être une longue copie entre systèmes
+    de fichiers : seul le staging de ses nouveaux fichiers attend, sans bloquer to_convert_lock.
+    """
+    with to_convert_lock:
+        if job_store.has_unfinished_jobs(folder):
             return
-        if not files_to_process:
+        
+        converted = job_store.paths_under(folder, JobStore.CONVERTED)
+        if not converted:
             return
-        conversion_in_progress = True
-        current_batch = files_to_process.copy()
+        importing_series.add(folder)
     
     try:
-        logging.info("Début du traitement des fichiers à convertir...")
+        import_converted_files(folder, converted)
+    finally:
+        with to_convert_lock:
+            importing_series.discard(folder)
+
+def import_converted_files(folder, converted):
+    """Déplace le dossier de série converti dans la bibliothèque et nettoie les fichiers source"""
+    category, series = os.path.relpath(folder, TO_CONVERT_DIR).split(os.sep)
+    source_dir, dest_dir, label = CATEGORIES[category]
+    series_path = os.path.join(source_dir, series)
+    
+    logging.info(f"Import de la série {series} ({label}): {len(converted)} fichiers")
+    import_start = time.monotonic()
+    if os.path.isdir(series_path) and not os.listdir(series_path):
+        # Tous les CBZ étaient déjà dans la bibliothèque (cache de conversion) : rien à déplacer
+        os.rmdir(series_path)
+    elif os.path.isdir(series_path):
+        if not move_series_folder(series_path, dest_dir):
+            metrics.inc("kavita_import_failures_total")
+            return
+        library_scanner.notify(os.path.join(dest_dir, series))
+    
+    job_store.set_state(converted, JobStore.MOVED)
+    
+    # Nettoyer uniquement les fichiers traités avec succès
+    clean_processed_files(converted)
+    job_store.delete(converted)
+    metrics.observe("kavita_stage_duration_seconds", time.monotonic() - import_start, stage="import")
+    
+    stats = cache_stats.snapshot()
+    logging.info(
+        f"Cache de conversion: {stats['hits']} fichiers déjà importés, "
+        f"{stats['misses']} conversions, {stats['duplicates']} doublons supprimés"
+    )
+
+def conversion_worker():
+    """Étape de conversion : convertit les fichiers de convert_queue au fil de l'eau"""
+    while True:
+        file_path = convert_queue.get()
+        try:
+            success = convert_job(file_path)
+        except Exception as e:
+            logging.error(f"Erreur pendant la conversion de {file_path}: {e}")
+            continue
+        finally:
+            convert_queue.release(file_path)
         
-        # 1. Convertir les fichiers
-        conversion_success = convert_files()
+        # Succès ou échec, la série peut devenir importable (dernier fichier converti ou abandonné)
+        folder = series_folder(file_path)
+        if folder is not None:
+            import_queue.put(folder)
+        elif success:
+            # Fichier hors d'un dossier de série : le CBZ reste dans cbz_convert
+            logging.warning(f"Fichier hors d'un dossier de série, non importé: {file_path}")
+            with to_convert_lock:
+                clean_processed_files([file_path])
+            job_store.delete([file_path])
+
+def import_worker():
+    """Étape d'import : renomme et déplace les séries dont toutes les conversions sont terminées"""
+    while True:
+        folders = {import_queue.get()}
         
-        # 2. Si la conversion a réussi, traiter les mangas, comics et BD
-        if conversion_success:
-            if rename_and_move(MANGA_SRC, MANGA_DEST, "Manga"):
-                if rename_and_move(COMICS_SRC, COMICS_DEST, "Comics"):
-                    rename_and_move(BD_SRC, BD_DEST, "BD")
-            
-            # 3. Nettoyer uniquement les fichiers traités avec succès
-            clean_processed_files(current_batch)
-            
-            logging.info("Traitement terminé avec succès")
-        else:
-            logging.error("Échec de la conversion, certains fichiers n'ont pas été traités")
-    
-    except Exception as e:
-        logging.error(f"Erreur pendant le traitement: {e}")
-    finally:
-        with processing_lock:
-            conversion_in_progress = False
+        # Regrouper les notifications en attente : chaque série n'est examinée qu'une fois par lot
+        while True:
+            try:
+                folders.add(import_queue.get_nowait())
+            except queue.Empty:
+                break
+        
+        for folder in sorted(folders):
+            try:
+                import_series(folder)
+            except Exception as e:
+                logging.error(f"Erreur pendant l'import de {folder}: {e}")
+                metrics.inc("kavita_import_failures_total")
+
+def start_pipeline():
+    """Démarre les workers de conversion et le worker d'import"""
+    for index in range(CONVERSION_WORKERS):
+        threading.Thread(target=conversion_worker, name=f"conversion-{index}", daemon=True).start()
+    threading.Thread(target=import_worker, name="import", daemon=True).start()
+    logging.info(
+        f"Pipeline démarré: {CONVERSION_WORKERS} worker(s) de conversion, "
+        f"budget de {MEMORY_BUDGET_MB} Mo et {CPU_BUDGET} processus"
+    )
 
 def should_ignore_file(file_path):
     """Détermine si un fichier doit être ignoré"""
@@ -328,30 +2528,10 @@ def should_ignore_file(file_path):
     
     return False
 
-def get_folder_path(file_path):
-    """Obtient le chemin du dossier parent d'un fichier"""
-    return os.path.dirname(file_path)
-
-def update_folder_files():
-    """Met à jour le dictionnaire des fichiers par dossier"""
-    folder_files.clear()
-    
-    for file_path in detected_files:
-        folder = get_folder_path(file_path)
-        if folder not in folder_files:
-            folder_files[folder] = []
-        folder_files[folder].append(file_path)
-
 def check_folder_stability(folder):
     """Vérifie si tous les fichiers d'un dossier sont stables"""
-    if folder not in folder_files:
-        return False
-    
-    for file_path in folder_files[folder]:
-        if file_path in detected_files and not detected_files[file_path]['stable']:
-            return False
-    
-    return True
+    folder_state = detected_files.folders.get(folder)
+    return folder_state is not None and folder_state.pending == 0
 
 def move_folder_to_convert(folder):
     """Déplace un dossier stable vers to_convert et retourne la liste des fichiers déplacés"""
@@ -368,43 +2548,44 @@ def move_folder_to_convert(folder):
     os.makedirs(os.path.dirname(dest_folder), exist_ok=True)
     
     moved_files = []
+    staging_start = time.monotonic()
     try:
         # Déplacer tous les fichiers stables
-        for file_path in folder_files[folder]:
-            if file_path in detected_files and detected_files[file_path]['stable']:
-                dest_file = os.path.join(TO_CONVERT_DIR, os.path.relpath(file_path, DOWNLOAD_DIR))
-                os.makedirs(os.path.dirname(dest_file), exist_ok=True)
-                shutil.move(file_path, dest_file)
-                moved_files.append(dest_file)
-                logging.info(f"Déplacé le fichier stable vers to_convert: {file_path}")
-                # Supprimer le fichier de notre suivi
-                del detected_files[file_path]
+        with to_convert_lock:
+            for file_path in detected_files.folder_file_paths(folder):
+                if detected_files.get(file_path).stable:
+                    dest_file = os.path.join(TO_CONVERT_DIR, os.path.relpath(file_path, DOWNLOAD_DIR))
+                    if series_folder(dest_file) in importing_series:
+                        # Série en cours d'import : le fichier reste suivi et sera déplacé au prochain passage
+                        continue
+                    os.makedirs(os.path.dirname(dest_file), exist_ok=True)
+                    move_file(file_path, dest_file)
+                    moved_files.append(dest_file)
+                    job_store.stage(file_path, dest_file)
+                    logging.info(f"Déplacé le fichier stable vers to_convert: {file_path}")
+                    # Supprimer le fichier de notre suivi
+                    detected_files.forget(file_path)
         
         # Supprimer le dossier source s'il est vide
         if os.path.exists(folder) and not os.listdir(folder):
             os.rmdir(folder)
             logging.info(f"Dossier source supprimé car vide: {folder}")
         
+        metrics.observe("kavita_stage_duration_seconds", time.monotonic() - staging_start, stage="staging")
         return moved_files
     except Exception as e:
         logging.error(f"Erreur lors du déplacement du dossier {folder} vers to_convert: {e}")
-        return []
+        # Les fichiers déjà déplacés sont enregistrés comme staged : ils doivent être traités
+        return moved_files
 
 def process_stable_folders():
-    """Traite les dossiers stables en les déplaçant vers to_convert"""
-    global conversion_in_progress
-    folders_to_process = []
-    
-    # Si une conversion est en cours, ne pas déplacer de nouveaux fichiers
-    with processing_lock:
-        if conversion_in_progress:
-            logging.info("Une conversion est en cours, report du déplacement des dossiers stables")
-            return
-    
+    """Traite les dossiers stables en les déplaçant vers to_convert
+
+    Le déplacement n'attend pas la fin des conversions en cours ; il est seulement suspendu
+    quand la file de conversion dépasse CONVERT_QUEUE_LIMIT fichiers.
+    """
     # Identifier les dossiers stables
-    for folder in folder_files:
-        if check_folder_stability(folder):
-            folders_to_process.append(folder)
+    folders_to_process = detected_files.stable_folders()
     
     # Si aucun dossier stable, sortir
     if not folders_to_process:
@@ -413,110 +2594,530 @@ def process_stable_folders():
     # Déplacer les dossiers stables vers to_convert
     moved_files = []
     for folder in folders_to_process:
+        if convert_queue.qsize() >= CONVERT_QUEUE_LIMIT:
+            logging.info("File de conversion pleine, report du déplacement des dossiers stables")
+            break
+        
         files = move_folder_to_convert(folder)
-        if files:
-            moved_files.extend(files)
-    
-    # Mettre à jour la liste des fichiers à traiter
-    with processing_lock:
-        files_to_process.extend(moved_files)
+        for file_path in files:
+            convert_queue.put(file_path)
+        moved_files.extend(files)
     
     logging.info(f"Ajout de {len(moved_files)} fichiers à la liste de traitement")
 
+def forget_file(file_path):
+    """Retire un fichier du suivi"""
+    if detected_files.forget(file_path):
+        logging.info(f"Fichier supprimé ou déplacé: {file_path}")
+
+def forget_tree(dir_path):
+    """Retire du suivi tous les fichiers situés sous un dossier"""
+    for file_path in detected_files.forget_tree(dir_path):
+        logging.info(f"Fichier supprimé ou déplacé: {file_path}")
+
+def refresh_file(file_path, touched=False, closed=False):
+    """Relit l'état d'un fichier suivi (stat) et met à jour l'index"""
+    try:
+        stat_result = os.stat(file_path)
+    except FileNotFoundError:
+        forget_file(file_path)
+        return
+    detected_files.observe(file_path, stat_result.st_size, stat_result.st_mtime, touched, closed)
+
+def list_download_folder(dir_path):
+    """Liste un dossier en une passe os.scandir et retourne ses sous-dossiers
+
+    Les résultats de stat de scandir sont réutilisés pour mettre à jour l'index, et les
+    fichiers qui ont disparu du dossier sont retirés du suivi.
+    """
+    subdirs = []
+    names = set()
+    with os.scandir(dir_path) as entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                # Tout le contenu d'un dossier temporaire .parts serait ignoré
+                if '.parts' not in entry.name:
+                    subdirs.append(entry.path)
+                continue
+
+            if not entry.is_file() or should_ignore_file(entry.path):
+                continue
+
+            stat_result = entry.stat()
+            names.add(entry.name)
+            detected_files.observe(entry.path, stat_result.st_size, stat_result.st_mtime)
+
+    folder = detected_files.folders.get(dir_path)
+    if folder is not None:
+        for name in [name for name in folder.files if name not in names]:
+            forget_file(os.path.join(dir_path, name))
+
+    return tuple(subdirs)
+
 def scan_download_directory():
-    """Scanne le répertoire de téléchargement pour détecter les nouveaux fichiers et leur stabilité"""
+    """Scanne le répertoire de téléchargement pour détecter les nouveaux fichiers et leur stabilité
+
+    Le scan se fait en une seule passe : un dossier dont le mtime n'a pas changé n'est pas relisté,
+    seuls ses fichiers encore instables sont revérifiés. Le coût d'un cycle dépend donc du nombre
+    de dossiers et de fichiers en cours de téléchargement, pas du nombre total de fichiers.
+    """
     if not os.path.exists(DOWNLOAD_DIR):
         os.makedirs(DOWNLOAD_DIR, exist_ok=True)
         logging.info(f"Répertoire de téléchargement créé: {DOWNLOAD_DIR}")
         return
     
-    current_time = datetime.now()
+    scan_start = time.time()
+    visited = set()
+    stack = [DOWNLOAD_DIR]
     
-    # Parcourir récursivement tous les fichiers dans le répertoire de téléchargement
-    for root, dirs, files in os.walk(DOWNLOAD_DIR):
-        for file in files:
-            file_path = os.path.join(root, file)
-            
-            # Ignorer les fichiers spécifiés
-            if should_ignore_file(file_path):
+    while stack:
+        dir_path = stack.pop()
+        try:
+            dir_mtime_ns = os.stat(dir_path).st_mtime_ns
+        except FileNotFoundError:
+            continue
+        visited.add(dir_path)
+        
+        cached = detected_files.dir_cache.get(dir_path)
+        if cached is not None and cached[0] == dir_mtime_ns:
+            # Listing inchangé : revérifier uniquement les fichiers encore instables
+            subdirs = cached[1]
+            for file_path in detected_files.pending_files(dir_path):
+                refresh_file(file_path)
+        else:
+            try:
+                subdirs = list_download_folder(dir_path)
+            except FileNotFoundError:
                 continue
-            
-            # Si le fichier n'est pas déjà dans notre liste
-            if file_path not in detected_files:
-                file_size = os.path.getsize(file_path)
-                detected_files[file_path] = {
-                    'size': file_size,
-                    'time': current_time,
-                    'stable': False,
-                    'stable_count': 0
-                }
-                logging.info(f"Nouveau fichier détecté: {file_path}")
+            if scan_start - dir_mtime_ns / 1e9 > DIR_MTIME_GRACE:
+                detected_files.dir_cache[dir_path] = (dir_mtime_ns, subdirs)
             else:
-                # Vérifier si la taille du fichier a changé
-                current_size = os.path.getsize(file_path)
-                if current_size != detected_files[file_path]['size']:
-                    detected_files[file_path] = {
-                        'size': current_size,
-                        'time': current_time,
-                        'stable': False,
-                        'stable_count': 0
-                    }
-                    logging.info(f"Fichier modifié: {file_path}")
-                elif not detected_files[file_path]['stable']:
-                    # Incrémenter le compteur de stabilité
-                    detected_files[file_path]['stable_count'] += 1
-                    
-                    # Marquer comme stable si la taille n'a pas changé pendant plusieurs vérifications
-                    # (ici, après 5 vérifications consécutives, soit environ 150 secondes avec un intervalle de 30s)
-                    if detected_files[file_path]['stable_count'] >= 5:
-                        detected_files[file_path]['stable'] = True
-                        logging.info(f"Fichier stable: {file_path}")
-    
-    # Supprimer les entrées pour les fichiers qui n'existent plus
-    file_paths = set()
-    for root, dirs, files in os.walk(DOWNLOAD_DIR):
+                detected_files.dir_cache.pop(dir_path, None)
+        
+        stack.extend(subdirs)
+    
+    # Supprimer les entrées des dossiers qui n'existent plus
+    for dir_path in [d for d in detected_files.dir_cache if d not in visited]:
+        del detected_files.dir_cache[dir_path]
+    for folder_path in [f for f in detected_files.folders if f not in visited]:
+        for file_path in detected_files.folder_file_paths(folder_path):
+            forget_file(file_path)
+    
+    metrics.observe("kavita_scan_duration_seconds", time.time() - scan_start)
+
+def refresh_pending_files():
+    """Vérifie la stabilité des seuls fichiers encore instables
+
+    En mode inotify, les créations, modifications et suppressions sont déjà remontées par les
+    événements ; en mode polling, ce contrôle s'intercale entre deux scans complets. Dans les deux
+    cas il suffit de revérifier la taille des fichiers en cours de téléchargement.
+    """
+    for file_path in detected_files.pending_files():
+        refresh_file(file_path)
+
+class InotifyWatcher:
+    """Surveillance événementielle du répertoire de téléchargement via inotify (Linux)
+
+    Les événements sont appliqués sur l'index `detected_files` : le coût en régime
+    établi dépend de l'activité dans le répertoire et non du nombre de fichiers qu'il contient.
+    """
+
+    # Constantes de <sys/inotify.h>
+    IN_MODIFY = 0x00000002
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_DELETE_SELF = 0x00000400
+    IN_MOVE_SELF = 0x00000800
+    IN_Q_OVERFLOW = 0x00004000
+    IN_IGNORED = 0x00008000
+    IN_ONLYDIR = 0x01000000
+    IN_ISDIR = 0x40000000
+
+    WATCH_MASK = (IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO |
+                  IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF)
+
+    # struct inotify_event { int wd; uint32_t mask; uint32_t cookie; uint32_t len; char name[]; }
+    EVENT_HEADER = struct.Struct('iIII')
+
+    def __init__(self, root):
+        self.root = root
+        self.needs_rescan = False
+        self._watches = {}  # wd -> chemin du dossier
+        self._dirs = {}     # chemin du dossier -> wd
+
+        # CDLL(None) expose les symboles de la libc du processus (glibc comme musl)
+        self._libc = ctypes.CDLL(None, use_errno=True)
+        self._libc.inotify_init1.argtypes = [ctypes.c_int]
+        self._libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self._libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+
+        self._fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, f"inotify_init1: {os.strerror(err)}")
+
+        try:
+            self._add_tree(root)
+        except OSError:
+            self.close()
+            raise
+
+    def __len__(self):
+        return len(self._dirs)
+
+    def close(self):
+        """Ferme le descripteur inotify (les watches sont libérés par le noyau)"""
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+    def _add_watch(self, path):
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(path), self.WATCH_MASK | self.IN_ONLYDIR)
+        if wd < 0:
+            err = ctypes.get_errno()
+            if err == errno.ENOSPC:
+                logging.error("Limite fs.inotify.max_user_watches atteinte, augmentez-la sur l'hôte")
+            raise OSError(err, f"inotify_add_watch: {os.strerror(err)}", path)
+
+        self._watches[wd] = path
+        self._dirs[path] = wd
+
+    def _add_tree(self, path):
+        """Surveille un dossier et ses sous-dossiers, et retourne les fichiers qu'ils contiennent déjà"""
+        found_files = []
+        for root, dirs, files in os.walk(path):
+            try:
+                self._add_watch(root)
+            except FileNotFoundError:
+                continue
+            # Le watch est posé avant le listing : rien ne peut échapper entre les deux
+            found_files.extend(os.path.join(root, file) for file in files)
+        return found_files
+
+    def _remove_tree(self, path):
+        """Arrête la surveillance d'un dossier déplacé ou supprimé et de ses sous-dossiers"""
+        prefix = path.rstrip(os.sep) + os.sep
+        for dir_path in [d for d in self._dirs if d == path or d.startswith(prefix)]:
+            wd = self._dirs.pop(dir_path)
+            self._watches.pop(wd, None)
+            self._libc.inotify_rm_watch(self._fd, wd)
+
+    def _read_events(self, timeout):
+        """Attend au plus `timeout` secondes et retourne les événements disponibles (wd, masque, nom)"""
+        ready, _, _ = select.select([self._fd], [], [], timeout)
+        if not ready:
+            return []
+
+        events = []
+        while True:
+            try:
+                data = os.read(self._fd, 64 * 1024)
+            except BlockingIOError:
+                break
+
+            offset = 0
+            while offset < len(data):
+                wd, mask, _cookie, length = self.EVENT_HEADER.unpack_from(data, offset)
+                offset += self.EVENT_HEADER.size
+                name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+                offset += length
+                events.append((wd, mask, name))
+        return events
+
+    def _apply(self, events):
+        """Applique un lot d'événements sur l'état de suivi des fichiers"""
+        dirty_files = set()
+        closed_files = set()
+        removed_files = set()
+
+        for wd, mask, name in events:
+            if mask & self.IN_Q_OVERFLOW:
+                logging.warning("File d'événements inotify saturée, resynchronisation complète nécessaire")
+                self.needs_rescan = True
+                continue
+
+            dir_path = self._watches.get(wd)
+            if dir_path is None:
+                continue
+
+            if mask & self.IN_IGNORED:
+                self._watches.pop(wd, None)
+                if self._dirs.get(dir_path) == wd:
+                    del self._dirs[dir_path]
+                continue
+
+            if mask & (self.IN_DELETE_SELF | self.IN_MOVE_SELF):
+                if dir_path == self.root:
+                    logging.warning(f"Le répertoire surveillé a disparu: {self.root}")
+                    self.needs_rescan = True
+                continue
+
+            path = os.path.join(dir_path, name)
+
+            if mask & self.IN_ISDIR:
+                if mask & (self.IN_CREATE | self.IN_MOVED_TO):
+                    try:
+                        new_files = self._add_tree(path)
+                    except OSError as e:
+                        logging.error(f"Impossible de surveiller le dossier {path}: {e}")
+                        self.needs_rescan = True
+                        continue
+                    dirty_files.update(new_files)
+                    removed_files.difference_update(new_files)
+                elif mask & (self.IN_DELETE | self.IN_MOVED_FROM):
+                    self._remove_tree(path)
+                    forget_tree(path)
+            elif mask & (self.IN_CREATE | self.IN_MODIFY):
+                dirty_files.add(path)
+                closed_files.discard(path)
+                removed_files.discard(path)
+            elif mask & (self.IN_CLOSE_WRITE | self.IN_MOVED_TO):
+                # Fichier refermé après écriture, ou renommé dans download une fois terminé
+                closed_files.add(path)
+                removed_files.discard(path)
+            elif mask & (self.IN_DELETE | self.IN_MOVED_FROM):
+                removed_files.add(path)
+                dirty_files.discard(path)
+                closed_files.discard(path)
+
+        if not dirty_files and not closed_files and not removed_files:
+            return
+
+        for file_path in removed_files:
+            forget_file(file_path)
+
+        # Les événements d'un même fichier sont regroupés : un seul stat par fichier et par lot
+        for file_path in dirty_files | closed_files:
+            if not should_ignore_file(file_path):
+                refresh_file(file_path, touched=file_path in dirty_files, closed=file_path in closed_files)
+
+    def poll(self, timeout):
+        """Traite les événements reçus pendant `timeout` secondes"""
+        deadline = time.monotonic() + timeout
+        while not self.needs_rescan:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            events = self._read_events(remaining)
+            if events:
+                self._apply(events)
+
+def create_watcher():
+    """Crée le watcher inotify selon KAVITA_WATCH_MODE, ou retourne None pour le mode polling"""
+    if WATCH_MODE == "poll":
+        return None
+
+    os.makedirs(DOWNLOAD_DIR, exist_ok=True)
+    try:
+        watcher = InotifyWatcher(DOWNLOAD_DIR)
+    except (OSError, AttributeError) as e:
+        logging.warning(f"inotify indisponible ({e}), utilisation du mode polling")
+        return None
+
+    # Les changements antérieurs à la pose des watches ne génèrent pas d'événement :
+    # un scan complet (sans cache de dossiers) resynchronise l'état
+    detected_files.dir_cache.clear()
+    scan_download_directory()
+    logging.info(f"Surveillance inotify active sur {len(watcher)} dossiers")
+    return watcher
+
+def requeue_due_retries():
+    """Remet en file les conversions échouées dont le délai avant nouvelle tentative est écoulé"""
+    retries = job_store.take_due_retries()
+    if retries:
+        for file_path in retries:
+            convert_queue.put(file_path)
+        logging.info(f"Nouvelle tentative de conversion pour {len(retries)} fichiers")
+
+def resume_jobs():
+    """Reprend l'état sauvegardé après un redémarrage (idempotent)"""
+    # 1. Compteurs de stabilité des téléchargements en cours
+    vanished = []
+    for file_path, size, mtime, stable_count, stable in job_store.load_detected():
+        if os.path.isfile(file_path):
+            detected_files.restore(file_path, size, mtime, stable_count, stable)
+        else:
+            vanished.append(file_path)
+    job_store.delete(vanished)
+    
+    # 2. Conversions interrompues : supprimer la sortie partielle et recommencer
+    interrupted = job_store.paths_in_state(JobStore.CONVERTING)
+    for file_path in interrupted:
+        partial_cbz = f"{conversion_output_path(file_path)}.tmp"
+        if os.path.exists(partial_cbz):
+            os.remove(partial_cbz)
+    job_store.set_state(interrupted, JobStore.STAGED)
+    
+    # 3. Fichiers déjà importés dans la bibliothèque : terminer le nettoyage
+    moved = job_store.paths_in_state(JobStore.MOVED)
+    clean_processed_files(moved)
+    job_store.delete(moved)
+    
+    # 4. Fichiers de to_convert inconnus de la base (déplacés avant un arrêt) : les adopter.
+    # Une copie entre systèmes de fichiers interrompue laisse un fichier .copying incomplet, alors
+    # que la source est toujours dans download : il est supprimé
+    known = set(job_store.paths_in_state(JobStore.STAGED, JobStore.FAILED, JobStore.CONVERTED))
+    for root, dirs, files in os.walk(TO_CONVERT_DIR):
         for file in files:
             file_path = os.path.join(root, file)
-            if not should_ignore_file(file_path):
-                file_paths.add(file_path)
+            if file.endswith(COPY_TEMP_SUFFIX):
+                os.remove(file_path)
+                logging.info(f"Copie interrompue supprimée: {file_path}")
+            elif file_path not in known and not should_ignore_file(file_path):
+                job_store.stage(None, file_path)
+                logging.info(f"Fichier orphelin repris dans to_convert: {file_path}")
+    
+    staged = job_store.paths_in_state(JobStore.STAGED)
+    for file_path in staged:
+        convert_queue.put(file_path)
+    
+    # 5. CBZ produits avant l'arrêt mais pas encore importés
+    converted = job_store.paths_in_state(JobStore.CONVERTED)
+    for folder in {series_folder(file_path) for file_path in converted} - {None}:
+        import_queue.put(folder)
     
-    deleted_files = [path for path in detected_files.keys() if path not in file_paths]
-    for path in deleted_files:
-        logging.info(f"Fichier supprimé ou déplacé: {path}")
-        del detected_files[path]
+    logging.info(
+        f"Reprise: {len(detected_files)} fichiers suivis, {len(staged)} fichiers à convertir, "
+        f"{len(interrupted)} conversions interrompues, {len(converted)} fichiers à importer"
+    )
+
+def publish_index_metrics():
+    """Publie les jauges de l'index des téléchargements
+
+    Appelée par la boucle principale, seule à modifier l'index : le serveur de métriques ne lit
+    que ces valeurs publiées, jamais l'index pendant qu'il change.
+    """
+    metrics.set("kavita_tracked_files", len(detected_files))
+    metrics.set("kavita_unstable_files", len(detected_files.pending_files()))
+
+def render_metrics():
+    """Met à jour les jauges instantanées et retourne toutes les mesures au format Prometheus
+
+    Seules des structures protégées par un verrou sont lues ici ; les jauges de l'index des
+    téléchargements sont publiées par la boucle principale (publish_index_metrics).
+    """
+    running, memory_used, _ = convert_queue.usage()
+    metrics.set("kavita_queue_depth", convert_queue.qsize(), stage="convert")
+    metrics.set("kavita_queue_depth", import_queue.qsize(), stage="import")
+    metrics.set("kavita_queue_depth", library_scanner.pending_count(), stage="library_scan")
+    metrics.set("kavita_conversions_running", running)
+    metrics.set("kavita_conversion_memory_reserved_mb", memory_used)
     
-    # Mettre à jour la liste des fichiers par dossier
-    update_folder_files()
+    for result, count in cache_stats.snapshot().items():
+        metrics.set("kavita_conversion_cache_total", count, result=result)
+    moves = move_stats.snapshot()
+    for method in ('renamed', 'linked', 'copied'):
+        metrics.set("kavita_moves_total", moves[method], method=method)
+    metrics.set("kavita_moved_bytes_copied_total", moves['copied_bytes'])
+    return metrics.render()
+
+class MetricsHandler(http.server.BaseHTTPRequestHandler):
+    """Sert /metrics au format texte Prometheus"""
+
+    def do_GET(self):
+        if self.path.split('?', 1)[0] != '/metrics':
+            self.send_error(404)
+            return
+        try:
+            body = render_metrics().encode()
+        except Exception as e:
+            logging.error(f"Erreur lors du calcul des métriques: {e}")
+            self.send_error(500)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Une ligne de journal par scrape noierait les journaux du pipeline
+        pass
+
+def start_metrics_server():
+    """Démarre l'endpoint /metrics dans un thread si KAVITA_METRICS_PORT est défini"""
+    if not METRICS_PORT:
+        return
+    try:
+        server = http.server.ThreadingHTTPServer(('', METRICS_PORT), MetricsHandler)
+    except OSError as e:
+        logging.error(f"Impossible d'ouvrir l'endpoint de métriques sur le port {METRICS_PORT}: {e}")
+        return
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    logging.info(f"Métriques Prometheus disponibles sur :{METRICS_PORT}/metrics")
 
-def check_to_convert_has_files():
-    """Vérifie si des fichiers sont prêts à être traités"""
-    with processing_lock:
-        return len(files_to_process) > 0
+def handle_shutdown(signum, frame):
+    """Arrêt du conteneur (SIGTERM) : tue les conversions en cours puis quitte"""
+    logging.info("Arrêt demandé, annulation des conversions en cours")
+    shutting_down.set()
+    cancel_running_jobs("arrêt du service")
+    raise SystemExit(0)
 
 def main():
     """Fonction principale de surveillance"""
+    global job_store
+    
     logging.info("Démarrage de la surveillance du répertoire de téléchargement...")
     logging.info(f"Extensions ignorées: {IGNORED_EXTENSIONS}")
     
+    logging.info(f"Mode de surveillance demandé: {WATCH_MODE}")
+    
     # Créer les répertoires nécessaires
     if not os.path.exists(TO_CONVERT_DIR):
         os.makedirs(TO_CONVERT_DIR, exist_ok=True)
     
+    signal.signal(signal.SIGTERM, handle_shutdown)
+    
+    # Reprendre les traitements interrompus par un redémarrage
+    job_store = JobStore(STATE_DB)
+    resume_jobs()
+    start_pipeline()
+    library_scanner.start()
+    start_metrics_server()
+    
+    logging.info(f"Politique de stabilité: {STABILITY_POLICY} (vérification toutes les {stability_policy.check_interval}s)")
+    watcher = create_watcher()
+    last_full_scan = time.monotonic()
+    
     while True:
         try:
-            # 1. Scanner le répertoire de téléchargement
-            scan_download_directory()
+            # Tant que des fichiers sont instables, les revérifier au rythme de la politique de stabilité
+            if detected_files.has_pending():
+                interval = min(SCAN_INTERVAL, stability_policy.check_interval)
+            else:
+                interval = SCAN_INTERVAL
+            
+            # 1. Mettre à jour l'état des fichiers téléchargés
+            if watcher is not None:
+                # Appliquer les événements inotify jusqu'à la prochaine vérification de stabilité
+                watcher.poll(interval)
+                if watcher.needs_rescan:
+                    watcher.close()
+                    watcher = create_watcher()
+                else:
+                    refresh_pending_files()
+            elif time.monotonic() - last_full_scan >= SCAN_INTERVAL or not detected_files.has_pending():
+                scan_download_directory()
+                last_full_scan = time.monotonic()
+            else:
+                refresh_pending_files()
             
             # 2. Traiter les dossiers stables (déplacer vers to_convert)
             process_stable_folders()
+            job_store.sync_detected(detected_files)
             
-            # 3. Si des fichiers sont dans to_convert et qu'aucune conversion n'est en cours
-            if check_to_convert_has_files() and not conversion_in_progress:
-                # Lancer le processus de conversion
-                threading.Thread(target=process_convert_directory, daemon=True).start()
+            # 3. Remettre en file les conversions à retenter ; la conversion et l'import
+            # tournent en continu dans les workers du pipeline
+            requeue_due_retries()
+            publish_index_metrics()
             
-            # Attendre 30 secondes avant la prochaine vérification
-            time.sleep(30)
+            # En mode polling, attendre avant la prochaine vérification
+            if watcher is None:
+                time.sleep(interval)
             
         except Exception as e:
             logging.error(f"Erreur durant la surveillance: {e}")